@@ -0,0 +1,161 @@
+# answer_cache.py
+"""
+Per-document cache of chat answers.
+
+A stored answer is reused when a new question about the same document
+is close enough to a cached one (cosine similarity of the question
+embeddings, or the same normalised text for questions answered without
+embeddings) AND retrieval picked the same chunk set, i.e. the LLM
+would see the same context. Entries expire after a TTL; each document
+keeps a bounded number of them, and documents are evicted LRU.
+"""
+import os
+import time
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import FrozenSet, List, Optional
+
+import numpy as np
+
+import metrics
+
+ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.92"))
+# seconds an answer is served from the cache (0 disables the cache)
+ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL", "3600"))
+ANSWER_CACHE_PER_DOC = int(os.getenv("ANSWER_CACHE_PER_DOC", "200"))
+ANSWER_CACHE_DOCS = int(os.getenv("ANSWER_CACHE_DOCS", "256"))
+
+
+def normalize(question: str) -> str:
+    return " ".join(question.lower().split())
+
+
+@dataclass
+class ChatKey:
+    """What an answer depends on: document, question, retrieved chunks."""
+
+    doc_id: str
+    question: str
+    chunks: FrozenSet[str]
+    vector: Optional[np.ndarray] = None  # unit question embedding, if any
+
+    @classmethod
+    def build(cls, doc_id: str, question: str, hits: List[dict], vector=None):
+        if vector is not None:
+            vector = np.asarray(vector, dtype=np.float32)
+            vector = vector / max(float(np.linalg.norm(vector)), 1e-12)
+        return cls(doc_id, normalize(question), frozenset(h["id"] for h in hits), vector)
+
+
+@dataclass
+class _Entry:
+    question: str
+    chunks: FrozenSet[str]
+    vector: Optional[np.ndarray]
+    answer: str
+    expires: float
+    used: float
+
+
+class DocAnswers:
+    """Cached answers of one document; question vectors stacked for one matvec."""
+
+    def __init__(self):
+        self.entries: List[_Entry] = []
+        self._matrix = None
+
+    def _expire(self, now: float):
+        live = [e for e in self.entries if e.expires > now]
+        if len(live) != len(self.entries):
+            self.entries = live
+            self._matrix = None
+
+    def _vectors(self, dim: int):
+        if self._matrix is None or self._matrix.shape[1] != dim:
+            # entries without an embedding get a zero row (never similar)
+            self._matrix = np.vstack([
+                e.vector if e.vector is not None and len(e.vector) == dim
+                else np.zeros(dim, dtype=np.float32)
+                for e in self.entries
+            ])
+        return self._matrix
+
+    def lookup(self, key: ChatKey, now: float) -> Optional[str]:
+        self._expire(now)
+        if not self.entries:
+            return None
+        for e in self.entries:
+            if e.question == key.question and e.chunks == key.chunks:
+                e.used = now
+                return e.answer
+        if key.vector is None:
+            return None
+        sims = self._vectors(len(key.vector)) @ key.vector
+        for i in np.argsort(-sims):
+            if sims[i] < ANSWER_CACHE_THRESHOLD:
+                break
+            e = self.entries[i]
+            if e.chunks == key.chunks:
+                e.used = now
+                return e.answer
+        return None
+
+    def store(self, key: ChatKey, answer: str, now: float):
+        self._expire(now)
+        self.entries.append(
+            _Entry(key.question, key.chunks, key.vector, answer, now + ANSWER_CACHE_TTL, now)
+        )
+        if len(self.entries) > ANSWER_CACHE_PER_DOC:
+            self.entries.remove(min(self.entries, key=lambda e: e.used))
+        self._matrix = None
+
+
+_docs: "OrderedDict[str, DocAnswers]" = OrderedDict()
+_lock = threading.Lock()
+_hits = 0
+_misses = 0
+
+
+def enabled() -> bool:
+    return ANSWER_CACHE_TTL > 0
+
+
+def lookup(key: ChatKey) -> Optional[str]:
+    global _hits, _misses
+    with _lock:
+        answers = _docs.get(key.doc_id)
+        answer = answers.lookup(key, time.monotonic()) if answers else None
+        if answers:
+            _docs.move_to_end(key.doc_id)
+        if answer is None:
+            _misses += 1
+        else:
+            _hits += 1
+    metrics.ANSWER_CACHE_LOOKUPS.inc(result="miss" if answer is None else "hit")
+    return answer
+
+
+def store(key: ChatKey, answer: str):
+    if not answer:
+        return
+    with _lock:
+        answers = _docs.get(key.doc_id)
+        if answers is None:
+            answers = _docs[key.doc_id] = DocAnswers()
+            while len(_docs) > ANSWER_CACHE_DOCS:
+                _docs.popitem(last=False)
+        _docs.move_to_end(key.doc_id)
+        answers.store(key, answer, time.monotonic())
+
+
+def stats() -> dict:
+    with _lock:
+        lookups = _hits + _misses
+        return {
+            "documents": len(_docs),
+            "answers": sum(len(a.entries) for a in _docs.values()),
+            "hits": _hits,
+            "misses": _misses,
+            "hit_rate": _hits / lookups if lookups else 0.0,
+        }
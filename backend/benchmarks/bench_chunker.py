@@ -0,0 +1,122 @@
+# benchmarks/bench_chunker.py
+"""
+Micro-benchmark: page-aware chunker vs the original whole-string chunker.
+
+    python benchmarks/bench_chunker.py [--pages 2000] [--repeat 3]
+
+Both produce a list of every chunk. The page-aware chunker does more per
+chunk (page numbers, sentence breaks, offset bookkeeping), so it is
+slower in pure Python; the legacy one also holds a copy of the whole
+joined text.
+"""
+import os
+import sys
+import time
+import random
+import statistics
+import argparse
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from chunker import iter_chunks  # noqa: E402
+
+
+def legacy_chunk_text_from_pages(pages, chunk_size=1000, overlap=200):
+    # the chunker main.py shipped with, kept verbatim as the baseline
+    text = "\n\n".join(pages)
+    L = len(text)
+    chunks, start, cid = [], 0, 0
+
+    while start < L:
+        end = start + chunk_size
+        part = text[start:end]
+
+        if end < L:
+            back = max(part.rfind("\n"), part.rfind(" "), part.rfind("."))
+            if back > int(chunk_size * 0.3):
+                end = start + back + 1
+                part = text[start:end]
+
+        part = part.strip()
+        if part:
+            chunks.append(
+                {
+                    "id": str(cid),
+                    "text": part,
+                    "start": start,
+                    "end": min(end, L),
+                }
+            )
+            cid += 1
+
+        start = max(0, end - overlap)
+        if end >= L:
+            break
+
+    return chunks
+
+
+WORDS = (
+    "the network learns weights by gradient descent and backpropagation "
+    "each layer applies a linear map followed by a nonlinearity loss "
+    "functions measure error while regularization limits overfitting"
+).split()
+
+
+def make_pages(n_pages: int, seed: int = 7):
+    rnd = random.Random(seed)
+    pages = []
+    for _ in range(n_pages):
+        lines = []
+        for _ in range(45):
+            sentence = " ".join(rnd.choice(WORDS) for _ in range(rnd.randint(6, 16)))
+            lines.append(sentence.capitalize() + rnd.choice([".", ".", "?", ":"]))
+        pages.append("\n".join(lines))
+    return pages
+
+
+def run(name, fn, pages, repeat):
+    # both sides are materialised into a list, so time and peak memory
+    # cover the same work: producing and holding every chunk
+    times = []
+    for _ in range(repeat):
+        t = time.perf_counter()
+        chunks = list(fn(pages))
+        times.append(time.perf_counter() - t)
+        del chunks
+
+    tracemalloc.start()
+    chunks = list(fn(pages))
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    print(
+        f"{name:<22} chunks={len(chunks):<7} best={min(times) * 1000:8.1f} ms  "
+        f"median={statistics.median(times) * 1000:8.1f} ms  peak={peak / 1e6:7.1f} MB"
+    )
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--pages", type=int, default=2000)
+    ap.add_argument("--repeat", type=int, default=3)
+    args = ap.parse_args()
+
+    pages = make_pages(args.pages)
+    size = sum(len(p) for p in pages)
+    print(f"{args.pages} pages, {size / 1e6:.1f} M chars\n")
+
+    run("legacy (list)", legacy_chunk_text_from_pages, pages, args.repeat)
+    run("chunker word", lambda p: iter_chunks(iter(p), boundary="word"), pages, args.repeat)
+    run("chunker sentence", lambda p: iter_chunks(iter(p), boundary="sentence"), pages, args.repeat)
+    run(
+        "chunker 200-token cap",
+        lambda p: iter_chunks(iter(p), max_tokens=200),
+        pages,
+        args.repeat,
+    )
+
+
+if __name__ == "__main__":
+    main()
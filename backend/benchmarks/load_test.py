@@ -0,0 +1,229 @@
+# benchmarks/load_test.py
+"""
+Load test for the API: upload, summary, mcq, chat and save-progress.
+
+Run the backend against local Mongo/Chroma with the fake Gemini backend
+(no quota used), then point this script at it:
+
+    GEMINI_BACKEND=fake uvicorn main:app
+    python benchmarks/load_test.py [--docs 4] [--requests 200] [--concurrency 32]
+
+Reports throughput and p50/p95/p99 latency per endpoint; --json writes
+the same numbers to a file for comparing runs. Needs httpx.
+"""
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+
+import fitz
+import httpx
+
+WORDS = (
+    "the network learns weights by gradient descent and backpropagation "
+    "each layer applies a linear map followed by a nonlinearity loss "
+    "functions measure error while regularization limits overfitting "
+    "convolution pooling attention embedding optimizer momentum dropout"
+).split()
+
+
+def make_pdf(n_pages: int, seed: int) -> bytes:
+    """A PDF with unique (per seed) prose, so every upload is really ingested."""
+    rnd = random.Random(seed)
+    pdf = fitz.open()
+    for p in range(n_pages):
+        page = pdf.new_page()
+        page.insert_text((50, 50), f"Document {seed} page {p + 1}", fontsize=12)
+        for line in range(45):
+            sentence = " ".join(rnd.choice(WORDS) for _ in range(rnd.randint(6, 12)))
+            page.insert_text((50, 75 + line * 15), sentence.capitalize() + ".", fontsize=8)
+    data = pdf.tobytes()
+    pdf.close()
+    return data
+
+
+def percentile(sorted_values, p: float) -> float:
+    # nearest-rank
+    if not sorted_values:
+        return 0.0
+    k = max(0, min(len(sorted_values) - 1, round(p / 100 * len(sorted_values) + 0.5) - 1))
+    return sorted_values[k]
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies = {}
+        self.errors = {}
+        self.windows = {}
+
+    def record(self, endpoint: str, started: float, ok: bool):
+        done = time.perf_counter()
+        first, last = self.windows.get(endpoint, (started, done))
+        self.windows[endpoint] = (min(first, started), max(last, done))
+        if ok:
+            self.latencies.setdefault(endpoint, []).append(done - started)
+        else:
+            self.errors[endpoint] = self.errors.get(endpoint, 0) + 1
+
+    async def timed(self, endpoint: str, coro):
+        """Await an httpx request; returns the response, or None on error."""
+        t = time.perf_counter()
+        try:
+            r = await coro
+            ok = r.status_code < 400
+        except httpx.HTTPError:
+            r, ok = None, False
+        self.record(endpoint, t, ok)
+        return r if ok else None
+
+    def report(self) -> dict:
+        out = {}
+        for endpoint in sorted(set(self.latencies) | set(self.errors)):
+            lat = sorted(self.latencies.get(endpoint, []))
+            first, last = self.windows[endpoint]
+            out[endpoint] = {
+                "count": len(lat),
+                "errors": self.errors.get(endpoint, 0),
+                "throughput_rps": len(lat) / (last - first) if last > first else 0.0,
+                "p50_ms": percentile(lat, 50) * 1000,
+                "p95_ms": percentile(lat, 95) * 1000,
+                "p99_ms": percentile(lat, 99) * 1000,
+                "max_ms": (lat[-1] if lat else 0.0) * 1000,
+            }
+        return out
+
+
+async def upload_docs(client, rec: Recorder, args) -> list:
+    """Upload --docs PDFs at once and wait until each is ingested."""
+
+    async def one(i):
+        data = make_pdf(args.pages, seed=args.seed * 1000 + i + int(time.time()))
+        t = time.perf_counter()
+        files = {"file": (f"load_{i}.pdf", data, "application/pdf")}
+        r = await rec.timed("upload", client.post("/upload", files=files))
+        if r is None:
+            return None
+        body = r.json()
+        if "job_id" not in body:
+            return body["doc_id"]  # deduplicated
+
+        while True:
+            job = (await client.get(f"/jobs/{body['job_id']}")).json()
+            if job["status"] in ("done", "failed"):
+                break
+            await asyncio.sleep(0.2)
+        rec.record("ingest (upload → done)", t, job["status"] == "done")
+        return body["doc_id"] if job["status"] == "done" else None
+
+    ids = await asyncio.gather(*[one(i) for i in range(args.docs)])
+    return [d for d in ids if d]
+
+
+async def mixed_load(client, rec: Recorder, doc_ids: list, args):
+    rnd = random.Random(args.seed)
+    force = args.regenerate
+
+    # save-progress needs generated MCQs to answer
+    await asyncio.gather(
+        *[
+            rec.timed("mcq", client.post("/mcq", json={"doc_id": d, "difficulty": "easy"}))
+            for d in doc_ids
+        ]
+    )
+    quizzes = {}
+    for d in doc_ids:
+        quizzes[d] = (await client.get(f"/docs/{d}/mcq")).json().get("easy", [])
+
+    def request(endpoint: str, doc_id: str):
+        if endpoint == "summary":
+            return client.post("/summary", json={"doc_id": doc_id, "force": force})
+        if endpoint == "mcq":
+            return client.post(
+                "/mcq", json={"doc_id": doc_id, "difficulty": "easy", "force": force}
+            )
+        if endpoint == "chat":
+            question = " ".join(rnd.choice(WORDS) for _ in range(6)) + "?"
+            return client.post("/chat", json={"doc_id": doc_id, "question": question})
+        questions = quizzes[doc_id][: rnd.randint(1, 5)]
+        return client.post(
+            "/mcq/save-progress",
+            json={
+                "doc_id": doc_id,
+                "difficulty": "easy",
+                "batch_ids": [q["id"] for q in questions],
+                "answers": {q["id"]: rnd.choice(q["options"] or [""]) for q in questions},
+            },
+        )
+
+    plan = [
+        (endpoint, rnd.choice(doc_ids))
+        for endpoint in ("summary", "mcq", "chat", "save-progress")
+        for _ in range(args.requests)
+    ]
+    rnd.shuffle(plan)
+
+    slots = asyncio.Semaphore(args.concurrency)
+
+    async def run(endpoint, doc_id):
+        async with slots:
+            await rec.timed(endpoint, request(endpoint, doc_id))
+
+    await asyncio.gather(*[run(e, d) for e, d in plan])
+
+
+def print_report(report: dict):
+    print(
+        f"{'endpoint':<24} {'ok':>6} {'err':>5} {'req/s':>8} "
+        f"{'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9}"
+    )
+    for endpoint, r in report.items():
+        print(
+            f"{endpoint:<24} {r['count']:>6} {r['errors']:>5} {r['throughput_rps']:>8.1f} "
+            f"{r['p50_ms']:>9.1f} {r['p95_ms']:>9.1f} {r['p99_ms']:>9.1f} {r['max_ms']:>9.1f}"
+        )
+
+
+async def main_async(args):
+    rec = Recorder()
+    timeout = httpx.Timeout(args.timeout)
+    limits = httpx.Limits(max_connections=args.concurrency + args.docs)
+    async with httpx.AsyncClient(base_url=args.base_url, timeout=timeout, limits=limits) as client:
+        t = time.perf_counter()
+        doc_ids = await upload_docs(client, rec, args)
+        print(f"ingested {len(doc_ids)}/{args.docs} docs in {time.perf_counter() - t:.1f} s")
+        if not doc_ids:
+            return 1
+
+        t = time.perf_counter()
+        await mixed_load(client, rec, doc_ids, args)
+        print(f"mixed load: {4 * args.requests} requests in {time.perf_counter() - t:.1f} s\n")
+
+    report = rec.report()
+    print_report(report)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"args": vars(args), "endpoints": report}, f, indent=2)
+    return 0
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--base-url", default="http://127.0.0.1:8000")
+    ap.add_argument("--docs", type=int, default=4, help="PDFs uploaded concurrently")
+    ap.add_argument("--pages", type=int, default=20, help="pages per PDF")
+    ap.add_argument("--requests", type=int, default=200, help="requests per endpoint")
+    ap.add_argument("--concurrency", type=int, default=32)
+    ap.add_argument(
+        "--regenerate", action="store_true", help="send force=true (measure generation, not cache)"
+    )
+    ap.add_argument("--timeout", type=float, default=120)
+    ap.add_argument("--seed", type=int, default=7)
+    ap.add_argument("--json", help="also write results to this file")
+    args = ap.parse_args()
+    sys.exit(asyncio.run(main_async(args)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,184 @@
+# chunker.py
+import os
+from bisect import bisect_right
+from typing import Iterable, Iterator, List, Optional
+
+CHUNK_SIZE = int(os.getenv("CHUNK_SIZE", "1000"))
+CHUNK_OVERLAP = int(os.getenv("CHUNK_OVERLAP", "200"))
+# "sentence" prefers sentence ends, "word" breaks at the last space/newline/period
+CHUNK_BOUNDARY = os.getenv("CHUNK_BOUNDARY", "sentence")
+
+# rough chars-per-token for Gemini on English prose
+CHARS_PER_TOKEN = 4
+# a break point must leave at least this fraction of chunk_size
+MIN_BREAK_FRACTION = 0.3
+
+PAGE_SEPARATOR = "\n\n"
+_WHITESPACE = " \t\r\n\f\v"
+
+
+def estimate_tokens(text: str) -> int:
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def _last_word_break(buf: str, lo: int, hi: int) -> int:
+    # each later search only covers the tail after the previous hit
+    # (a hit there is always later, so it simply replaces b)
+    b = buf.rfind(" ", lo, hi)
+    i = buf.rfind("\n", b + 1, hi)
+    if i != -1:
+        b = i
+    i = buf.rfind(".", b + 1, hi)
+    if i != -1:
+        b = i
+    return b
+
+
+def _last_sentence_break(buf: str, lo: int, hi: int) -> int:
+    """
+    Index of the whitespace that ends the last sentence in [lo, hi), or -1.
+    A sentence ends at . ? ! followed by whitespace, or at a blank line.
+    """
+    best = lo - 1
+    for p in ".?!":
+        # "." first: it is the likeliest hit, and later scans stop at `best`
+        i = buf.rfind(p, best + 1, hi - 1)
+        while i != -1 and buf[i + 1] not in _WHITESPACE:
+            i = buf.rfind(p, best + 1, i)
+        if i != -1:
+            best = i + 1
+    i = buf.rfind("\n\n", best + 1, hi)
+    if i != -1:
+        best = i + 1
+    return best if best >= lo else -1
+
+
+class _Window:
+    """
+    The joined text (pages separated by a blank line) from global offset
+    `base` onwards. Only a single string is kept; offsets are global.
+    """
+
+    def __init__(self):
+        self.buf = ""
+        self.base = 0
+        self.end = 0  # global offset just past the text
+        self.page_starts: List[int] = []
+
+    def append_page(self, text: str):
+        if self.page_starts:
+            self.buf += PAGE_SEPARATOR
+            self.end += len(PAGE_SEPARATOR)
+        self.page_starts.append(self.end)
+        self.buf += text
+        self.end += len(text)
+
+    def drop_before(self, offset: int):
+        if offset > self.base:
+            self.buf = self.buf[offset - self.base:]
+            self.base = offset
+
+
+def _cut(win: _Window, start: int, size: int, final: bool, boundary: str):
+    """
+    Decide the chunk [start, end) and return
+    (text_start, text_end, end) where text_* excludes outer whitespace
+    and end is where the chunk stops (break char included).
+    """
+    buf, base = win.buf, win.base
+    lo, hi = start - base, min(start + size, win.end) - base
+    end = hi
+
+    if not (final and hi == len(buf)):
+        # breaks before min_break are rejected, so never scan that far back
+        min_break = lo + int(size * MIN_BREAK_FRACTION) + 1
+        b = -1
+        if boundary == "sentence":
+            b = _last_sentence_break(buf, min_break, hi)
+        if b < min_break:
+            b = _last_word_break(buf, min_break, hi)
+        if b >= min_break:
+            end = b + 1
+
+    # strip via offsets; the text is copied only once, at emit
+    s, e = lo, end
+    while s < e and buf[s] in _WHITESPACE:
+        s += 1
+    while e > s and buf[e - 1] in _WHITESPACE:
+        e -= 1
+    return s + base, e + base, end + base
+
+
+def _next_start(win: _Window, start: int, end: int, overlap: int) -> int:
+    """
+    Start of the next chunk: `overlap` chars back, moved to a word start.
+    Never at or before `start`: a chunk shorter than the overlap is not
+    overlapped, so no near-duplicate chunks start a character apart.
+    """
+    nxt = end - overlap if end > overlap else 0
+    if nxt <= start:
+        return end if end > start else start + 1
+    if overlap:
+        ws = win.buf.find(" ", nxt - win.base, end - win.base)
+        if ws != -1:
+            nxt = ws + 1 + win.base
+    return nxt
+
+
+def iter_chunks(
+    pages: Iterable[str],
+    chunk_size: int = CHUNK_SIZE,
+    overlap: int = CHUNK_OVERLAP,
+    boundary: str = CHUNK_BOUNDARY,
+    max_tokens: Optional[int] = None,
+) -> Iterator[dict]:
+    """
+    Chunk pages as they arrive.
+
+    Every chunk carries exact global offsets of its text (`start`, `end`,
+    pages joined by a blank line) and the 1-based pages it spans
+    (`page_start`, `page_end`). `max_tokens` caps a chunk's estimated
+    token count on top of `chunk_size`.
+    """
+    size = chunk_size
+    if max_tokens:
+        size = min(size, max_tokens * CHARS_PER_TOKEN)
+    # a break may land just past min_break: keep the overlap below it,
+    # so the next chunk always starts after this one's start
+    overlap = min(overlap, int(size * MIN_BREAK_FRACTION))
+
+    win = _Window()
+    start, cid = 0, 0
+
+    def emit(s, e):
+        nonlocal cid
+        base, starts = win.base, win.page_starts
+        chunk = {
+            "id": str(cid),
+            "text": win.buf[s - base:e - base],
+            "start": s,
+            "end": e,
+            # 1-based pages (page 1 starts at offset 0)
+            "page_start": bisect_right(starts, s),
+            "page_end": bisect_right(starts, e - 1),
+        }
+        cid += 1
+        return chunk
+
+    for page in pages:
+        win.append_page(page)
+        # only cut while the chunk provably does not reach the end of text
+        while start + size < win.end:
+            s, e, end = _cut(win, start, size, False, boundary)
+            if e > s:
+                yield emit(s, e)
+            start = _next_start(win, start, end, overlap)
+        win.drop_before(start)
+
+    while start < win.end:
+        s, e, end = _cut(win, start, size, True, boundary)
+        if e > s:
+            yield emit(s, e)
+        if end >= win.end:
+            break
+        start = _next_start(win, start, end, overlap)
@@ -0,0 +1,119 @@
+# context.py
+import os
+from typing import List
+
+from chunker import estimate_tokens
+
+# prompt context budget per endpoint, in (estimated) tokens
+CONTEXT_BUDGETS = {
+    name: int(os.getenv(f"CONTEXT_BUDGET_{name.upper()}", default))
+    for name, default in (
+        ("summary", "4000"),
+        ("notes", "4500"),
+        ("mcq", "3000"),
+        ("fillups", "3000"),
+        ("chat", "1500"),
+    )
+}
+
+SEPARATOR = "\n---\n"
+# hits whose gap is at most this many chars (the page separator) are joined
+ADJACENT_GAP = 2
+# don't bother adding a truncated span smaller than this
+MIN_PARTIAL_TOKENS = 100
+
+
+def _overlap_len(left: str, right: str, hint: int) -> int:
+    """
+    How many leading chars of `right` repeat the end of `left`.
+    `hint` comes from the offsets; older chunks stored offsets before
+    whitespace was stripped, so look a few chars around it.
+    """
+    if hint <= 0:
+        return 0
+    for k in sorted(range(max(1, hint - 8), hint + 9), key=lambda k: abs(k - hint)):
+        if k <= len(right) and left.endswith(right[:k]):
+            return k
+    return 0
+
+
+def _spans(hits: List[dict]):
+    spans, loose = [], []
+    for rank, h in enumerate(hits):
+        meta = h.get("metadata") or {}
+        start, end = meta.get("start"), meta.get("end")
+        span = {
+            "group": meta.get("doc_id"),
+            "start": start,
+            "end": end,
+            "text": h["document"],
+            "rank": rank,
+        }
+        if start is None or end is None:
+            loose.append(span)
+        else:
+            spans.append(span)
+    return spans, loose
+
+
+def merge_hits(hits: List[dict]) -> List[dict]:
+    """
+    Merge overlapping/adjacent hits into contiguous spans, in document order.
+    Each span keeps the best (lowest) relevance rank of its hits.
+    """
+    spans, loose = _spans(hits)
+    spans.sort(key=lambda s: (str(s["group"]), s["start"], -s["end"]))
+
+    merged = []
+    for s in spans:
+        cur = merged[-1] if merged else None
+        if (
+            cur is None
+            or cur["group"] != s["group"]
+            or s["start"] > cur["end"] + ADJACENT_GAP
+        ):
+            merged.append(dict(s))
+            continue
+
+        cur["rank"] = min(cur["rank"], s["rank"])
+        if s["end"] <= cur["end"]:
+            continue  # fully inside the current span
+
+        if s["start"] < cur["end"]:
+            k = _overlap_len(cur["text"], s["text"], cur["end"] - s["start"])
+            cur["text"] = cur["text"] + (s["text"][k:] if k else "\n" + s["text"])
+        else:
+            cur["text"] = cur["text"] + "\n" + s["text"]
+        cur["end"] = s["end"]
+
+    return merged + loose
+
+
+def _truncate(text: str, max_tokens: int) -> str:
+    cut = text[: max_tokens * 4]
+    space = cut.rfind(" ")
+    return cut[:space] if space > len(cut) // 2 else cut
+
+
+def pack_context(hits: List[dict], max_tokens: int) -> str:
+    """
+    Build prompt context from retrieved hits (most relevant first):
+    merge overlapping/adjacent chunks, keep the most relevant spans that
+    fit in `max_tokens`, and emit them in document order.
+    """
+    spans = merge_hits(hits)
+
+    chosen, used = [], 0
+    for s in sorted(spans, key=lambda s: s["rank"]):
+        cost = estimate_tokens(s["text"])
+        left = max_tokens - used
+        if cost > left:
+            if left < MIN_PARTIAL_TOKENS:
+                continue
+            s = {**s, "text": _truncate(s["text"], left)}
+            cost = estimate_tokens(s["text"])
+        chosen.append(s)
+        used += cost
+
+    chosen.sort(key=lambda s: (s["start"] is None, str(s["group"]), s["start"] or 0))
+    return SEPARATOR.join(s["text"] for s in chosen)
@@ -3,13 +3,110 @@ from dotenv import load_dotenv
 load_dotenv()
 
 import os
-from pymongo import MongoClient
+from pymongo import AsyncMongoClient, ASCENDING
 
 MONGO_URI = os.getenv("MONGO_URI", "mongodb://localhost:27017")
 MONGO_DB_NAME = os.getenv("MONGO_DB_NAME", "project_tutor")
 
-client = MongoClient(MONGO_URI)
-db = client[MONGO_DB_NAME]
+# connection pool per worker process
+MONGO_MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", "50"))
+MONGO_MIN_POOL_SIZE = int(os.getenv("MONGO_MIN_POOL_SIZE", "0"))
+MONGO_MAX_IDLE_MS = int(os.getenv("MONGO_MAX_IDLE_MS", "60000"))
+MONGO_CONNECT_TIMEOUT_MS = int(os.getenv("MONGO_CONNECT_TIMEOUT_MS", "5000"))
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", "5000"))
+
+_client = None
+_client_pid = None
+
+
+def get_client():
+    """
+    This process's client, created on first use. PyMongo clients must
+    not be shared across fork(), so a forked worker gets its own.
+    """
+    global _client, _client_pid
+    if _client is None or _client_pid != os.getpid():
+        # PyMongo's native asyncio client; every call below must be awaited
+        _client = AsyncMongoClient(
+            MONGO_URI,
+            maxPoolSize=MONGO_MAX_POOL_SIZE,
+            minPoolSize=MONGO_MIN_POOL_SIZE,
+            maxIdleTimeMS=MONGO_MAX_IDLE_MS,
+            connectTimeoutMS=MONGO_CONNECT_TIMEOUT_MS,
+            serverSelectionTimeoutMS=MONGO_SERVER_SELECTION_TIMEOUT_MS,
+        )
+        _client_pid = os.getpid()
+    return _client
+
+
+def get_db():
+    return get_client()[MONGO_DB_NAME]
+
+
+async def close_client():
+    global _client
+    if _client is not None and _client_pid == os.getpid():
+        await _client.close()
+    _client = None
+
+
+async def ping():
+    await get_client().admin.command("ping")
+
+
+class _LazyCollection:
+    """Module-level collection handle; binds to this process's client on use."""
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __getattr__(self, attr):
+        return getattr(get_db()[self.name], attr)
+
 
 # Documents collection (stores llm_output + metadata)
-documents_collection = db["documents"]
+documents_collection = _LazyCollection("documents")
+
+# Chunk texts, one record per chunk (keyed by the indexed doc_id)
+chunks_collection = _LazyCollection("chunks")
+
+# Background jobs (upload ingestion status)
+jobs_collection = _LazyCollection("jobs")
+
+# Single-flight leases (one generation per key across workers)
+leases_collection = _LazyCollection("leases")
+
+# Map-reduce partial results, keyed by a hash of the chunk group + map prompt
+partials_collection = _LazyCollection("partials")
+
+
+async def ensure_indexes():
+    """Create the indexes every hot path relies on (idempotent)."""
+    await documents_collection.create_index([("doc_id", ASCENDING)], unique=True)
+    await documents_collection.create_index(
+        [("content_hash", ASCENDING), ("chroma_indexed", ASCENDING)]
+    )
+    await chunks_collection.create_index(
+        [("doc_id", ASCENDING), ("seq", ASCENDING)], unique=True
+    )
+    await jobs_collection.create_index([("job_id", ASCENDING)], unique=True)
+    # Mongo removes leases shortly after they expire
+    await leases_collection.create_index(
+        [("expires_at", ASCENDING)], expireAfterSeconds=0
+    )
+
+
+def chunk_record(doc_id: str, chunk: dict) -> dict:
+    return {
+        "doc_id": doc_id,
+        "seq": int(chunk["id"]),
+        "chunk_id": chunk["id"],
+        "text": chunk["text"],
+        "start": chunk.get("start"),
+        "end": chunk.get("end"),
+        "page_start": chunk.get("page_start"),
+        "page_end": chunk.get("page_end"),
+        # BM25 term frequencies (see lexical.py); absent on older records
+        "terms": chunk.get("terms"),
+        "length": chunk.get("length"),
+    }
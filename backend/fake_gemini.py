@@ -0,0 +1,151 @@
+# fake_gemini.py
+"""
+Local stand-in for the Gemini provider calls, for load tests and
+offline development. Enabled with GEMINI_BACKEND=fake.
+
+Outputs depend only on the input: the same prompt always gets the same
+JSON/answer, and the same text always gets the same vector (hashed bag
+of words, so texts sharing words are close, and retrieval still behaves).
+Latency and errors are simulated from a seeded RNG.
+"""
+import os
+import re
+import json
+import math
+import random
+import asyncio
+import hashlib
+from typing import List
+
+from google.api_core import exceptions as gexc
+
+# mean latency per call, and +/- jitter as a fraction of it
+FAKE_LLM_LATENCY_MS = float(os.getenv("FAKE_LLM_LATENCY_MS", "800"))
+FAKE_EMBED_LATENCY_MS = float(os.getenv("FAKE_EMBED_LATENCY_MS", "60"))
+FAKE_LATENCY_JITTER = float(os.getenv("FAKE_LATENCY_JITTER", "0.3"))
+# fraction of calls that fail with a retryable provider error
+FAKE_ERROR_RATE = float(os.getenv("FAKE_ERROR_RATE", "0"))
+FAKE_EMBED_DIM = int(os.getenv("FAKE_EMBED_DIM", "768"))
+# pieces per streamed answer arrive this far apart
+FAKE_STREAM_PIECE_MS = float(os.getenv("FAKE_STREAM_PIECE_MS", "30"))
+
+_rng = random.Random(int(os.getenv("FAKE_SEED", "1234")))
+_WORD = re.compile(r"[a-z0-9]+")
+
+
+async def _latency(mean_ms: float):
+    if FAKE_ERROR_RATE and _rng.random() < FAKE_ERROR_RATE:
+        # fail after a short delay, like a real 503/429 would
+        await asyncio.sleep(mean_ms / 4000)
+        raise _rng.choice((gexc.ServiceUnavailable, gexc.ResourceExhausted))(
+            "fake Gemini error"
+        )
+    if mean_ms > 0:
+        spread = mean_ms * FAKE_LATENCY_JITTER
+        await asyncio.sleep(max(0.0, _rng.uniform(mean_ms - spread, mean_ms + spread)) / 1000)
+
+
+def _seed(text: str) -> int:
+    return int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "big")
+
+
+# ---------------------------
+# Embeddings
+# ---------------------------
+def fake_vector(text: str, dim: int = FAKE_EMBED_DIM) -> List[float]:
+    vec = [0.0] * dim
+    for word in _WORD.findall(text.lower()):
+        h = _seed(word)
+        vec[h % dim] += 1.0 if (h >> 32) & 1 else -1.0
+    norm = math.sqrt(sum(v * v for v in vec))
+    if not norm:
+        # no words at all: still a stable, non-zero vector
+        vec[_seed(text) % dim] = 1.0
+        return vec
+    return [v / norm for v in vec]
+
+
+async def embed_batch(texts: List[str]) -> List[List[float]]:
+    await _latency(FAKE_EMBED_LATENCY_MS)
+    return [fake_vector(t) for t in texts]
+
+
+# ---------------------------
+# Generation
+# ---------------------------
+def _context_words(prompt: str, rnd: random.Random, n: int) -> List[str]:
+    m = re.search(r"Context:\s*(.*?)(?:\n\s*(?:PagesCount|Question):|\Z)", prompt, re.S)
+    words = [w for w in _WORD.findall((m.group(1) if m else prompt).lower()) if len(w) > 3]
+    if not words:
+        words = ["topic"]
+    return [rnd.choice(words) for _ in range(n)]
+
+
+def _sentence(rnd: random.Random, prompt: str, n: int = 12) -> str:
+    return " ".join(_context_words(prompt, rnd, n)).capitalize() + "."
+
+
+def _count(prompt: str, default: int = 10) -> int:
+    m = re.search(r"Generate EXACTLY (\d+)", prompt)
+    return int(m.group(1)) if m else default
+
+
+def fake_answer(prompt: str) -> str:
+    """Deterministic response shaped like what the prompt asks for."""
+    rnd = random.Random(_seed(prompt))
+
+    if "MCQs" in prompt:
+        items = []
+        for i in range(_count(prompt)):
+            options = _context_words(prompt, rnd, 4)
+            items.append(
+                {
+                    "id": f"q{i + 1}",
+                    "question": _sentence(rnd, prompt, 8)[:-1] + "?",
+                    "options": options,
+                    "answer": rnd.choice(options),
+                    "explanation": _sentence(rnd, prompt),
+                }
+            )
+        return json.dumps(items)
+
+    if "fill-ups" in prompt:
+        items = []
+        for i in range(_count(prompt)):
+            words = _context_words(prompt, rnd, 10)
+            answer = words[rnd.randrange(len(words))]
+            text = " ".join("____" if w == answer else w for w in words)
+            items.append({"id": f"f{i + 1}", "text": text, "answer": answer})
+        return json.dumps(items)
+
+    if '"sections"' in prompt:
+        sections = [
+            {
+                "heading": " ".join(_context_words(prompt, rnd, 3)).title(),
+                "explanation": " ".join(_sentence(rnd, prompt) for _ in range(4)),
+                "points": [_sentence(rnd, prompt, 8) for _ in range(5)],
+            }
+            for _ in range(4)
+        ]
+        return json.dumps({"sections": sections, "keywords": _context_words(prompt, rnd, 6)})
+
+    if '"summary"' in prompt:
+        paragraphs = [" ".join(_sentence(rnd, prompt) for _ in range(5)) for _ in range(3)]
+        return json.dumps({"summary": "\n\n".join(paragraphs)})
+
+    return " ".join(_sentence(rnd, prompt) for _ in range(3))
+
+
+async def generate(prompt: str) -> str:
+    await _latency(FAKE_LLM_LATENCY_MS)
+    return fake_answer(prompt)
+
+
+async def generate_stream(prompt: str):
+    # time to first piece is a fraction of a full call, as with the real API
+    await _latency(FAKE_LLM_LATENCY_MS / 4)
+    words = fake_answer(prompt).split(" ")
+    for i in range(0, len(words), 5):
+        if i:
+            await asyncio.sleep(FAKE_STREAM_PIECE_MS / 1000)
+        yield " ".join(words[i:i + 5]) + (" " if i + 5 < len(words) else "")
@@ -1,63 +1,831 @@
-# gemini_client.py
 import os
 import time
+import random
+import asyncio
+import sqlite3
+import hashlib
+import logging
+import threading
+from array import array
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import List, Optional
+
 import google.generativeai as genai
+from google.api_core import exceptions as gexc
+
+import metrics
+from chunker import estimate_tokens
 
 LLM_MODEL = "gemini-2.5-flash"
 EMBED_MODEL = "text-embedding-004"
+# "google" talks to Gemini; "fake" uses fake_gemini (local, deterministic)
+GEMINI_BACKEND = os.getenv("GEMINI_BACKEND", "google")
+
+# batchEmbedContents accepts at most 100 texts per request
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "100"))
+# how many batches may be in flight at once (shared by the whole event loop)
+EMBED_MAX_IN_FLIGHT = int(os.getenv("EMBED_MAX_IN_FLIGHT", "4"))
+EMBED_MAX_RETRIES = int(os.getenv("EMBED_MAX_RETRIES", "3"))
+# single query embeddings arriving within this window share one call (0 = off)
+EMBED_QUERY_BATCH_MS = float(os.getenv("EMBED_QUERY_BATCH_MS", "5"))
+EMBED_QUERY_BATCH_MAX = int(os.getenv("EMBED_QUERY_BATCH_MAX", "32"))
+
+# provider quotas per minute (0 = unlimited); keep them a bit under the
+# project's real Gemini quota
+LLM_RPM = int(os.getenv("LLM_RPM", "1000"))
+LLM_TPM = int(os.getenv("LLM_TPM", "1000000"))
+EMBED_RPM = int(os.getenv("EMBED_RPM", "1500"))
+EMBED_TPM = int(os.getenv("EMBED_TPM", "0"))
+# LLM calls in flight at once, per process
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "64"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "3"))
+# consecutive provider failures that open the breaker, and how long it stays open
+BREAKER_THRESHOLD = int(os.getenv("GEMINI_BREAKER_THRESHOLD", "5"))
+BREAKER_COOLDOWN = float(os.getenv("GEMINI_BREAKER_COOLDOWN", "30"))
+
+# embedding cache: in-process LRU (entries) + sqlite file ("" disables disk tier)
+EMBED_CACHE_SIZE = int(os.getenv("EMBED_CACHE_SIZE", "20000"))
+EMBED_CACHE_PATH = os.getenv("EMBED_CACHE_PATH", "./embed_cache.sqlite3")
+EMBED_DISK_CACHE_MAX = int(os.getenv("EMBED_DISK_CACHE_MAX", "500000"))
+
+logger = logging.getLogger("backend.gemini")
+
+_configured = False
+_configure_lock = threading.Lock()
+_llm_model = None
+
 
 def configure():
-    api_key = os.getenv("GEMINI_API_KEY")
-    if not api_key:
-        raise RuntimeError("GEMINI_API_KEY is not set in environment")
-    genai.configure(api_key=api_key)
+    """Configure the SDK once per process."""
+    global _configured
+    if _configured:
+        return
+    with _configure_lock:
+        if _configured:
+            return
+        if GEMINI_BACKEND == "fake":
+            _configured = True
+            return
+        api_key = os.getenv("GEMINI_API_KEY")
+        if not api_key:
+            raise RuntimeError("GEMINI_API_KEY is not set in environment")
+        genai.configure(api_key=api_key)
+        _configured = True
 
-def call_llm_once(prompt: str, max_retries: int = 2) -> str:
-    configure()
-    model = genai.GenerativeModel(LLM_MODEL)
+
+def llm_model():
+    """The process-wide GenerativeModel (built once)."""
+    global _llm_model
+    if _llm_model is None:
+        configure()
+        _llm_model = genai.GenerativeModel(LLM_MODEL)
+    return _llm_model
+
+
+def _backoff(attempt: int, base: float = 1.0, cap: float = 20.0) -> float:
+    # exponential backoff with full jitter
+    return random.uniform(0, min(cap, base * (2 ** (attempt - 1))))
+
+
+# ---------------------------
+# Shared client layer: rate limits, concurrency, circuit breaker
+# ---------------------------
+# errors that mean "provider busy/down": retried and counted by the breaker
+RETRYABLE = (
+    gexc.ResourceExhausted,
+    gexc.TooManyRequests,
+    gexc.ServiceUnavailable,
+    gexc.InternalServerError,
+    gexc.BadGateway,
+    gexc.GatewayTimeout,
+    gexc.DeadlineExceeded,
+    asyncio.TimeoutError,
+    ConnectionError,
+)
+
+
+class CircuitOpen(RuntimeError):
+    """Raised without calling Gemini while the breaker is open."""
+    pass
+
+
+class TokenBucket:
+    """
+    Refills `per_minute` units per minute, bursting up to one minute's
+    worth. Waiters are served in arrival order.
+    """
+
+    def __init__(self, per_minute: int):
+        self.per_minute = per_minute
+        self.level = float(per_minute)
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.level = min(
+            self.per_minute, self.level + (now - self._updated) * self.per_minute / 60
+        )
+        self._updated = now
+
+    async def acquire(self, amount: int = 1) -> float:
+        """Take `amount` units, waiting if needed; returns seconds waited."""
+        if self.per_minute <= 0:
+            return 0.0
+        amount = min(amount, self.per_minute)
+        waited = 0.0
+        async with self._lock:
+            while True:
+                self._refill()
+                if self.level >= amount:
+                    self.level -= amount
+                    return waited
+                delay = (amount - self.level) * 60 / self.per_minute
+                waited += delay
+                await asyncio.sleep(delay)
+
+    def state(self) -> dict:
+        if self.per_minute <= 0:
+            return {"per_minute": 0}
+        self._refill()
+        return {"per_minute": self.per_minute, "available": int(self.level)}
+
+
+class CircuitBreaker:
+    """
+    closed → open after `threshold` consecutive provider failures;
+    open → half-open after `cooldown` seconds, letting one trial call
+    through; the trial's outcome closes or re-opens it. A trial that
+    never reports back re-opens it after another `cooldown`.
+    """
+
+    def __init__(self, threshold: int, cooldown: float):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self._trial = False
+        self._trial_started = 0.0
+
+    def _refresh(self):
+        now = time.monotonic()
+        if self.state == "half_open" and self._trial and now - self._trial_started >= self.cooldown:
+            # the trial was lost (e.g. cancelled without release): open again,
+            # counted from when the trial started
+            self._trial = False
+            self.state = "open"
+            self.opened_at = self._trial_started
+        if self.state == "open" and now - self.opened_at >= self.cooldown:
+            self.state = "half_open"
+
+    def check(self):
+        """Raise CircuitOpen if a call would be refused now (takes nothing)."""
+        self._refresh()
+        if self.state == "open" or (self.state == "half_open" and self._trial):
+            raise CircuitOpen("Gemini is unavailable, try again shortly.")
+
+    def before_call(self):
+        """Admit a call; in half-open state it becomes the single trial."""
+        self.check()
+        if self.state == "half_open":
+            self._trial = True
+            self._trial_started = time.monotonic()
+
+    def record_success(self):
+        self.state = "closed"
+        self.failures = 0
+        self._trial = False
+
+    def record_failure(self):
+        self.failures += 1
+        self._trial = False
+        if self.state == "half_open" or self.failures >= self.threshold:
+            if self.state != "open":
+                logger.warning(f"Gemini circuit breaker opened after {self.failures} failures")
+            self.state = "open"
+            self.opened_at = time.monotonic()
+
+    def release(self):
+        """Call abandoned without an outcome (e.g. cancelled)."""
+        self._trial = False
+
+    def snapshot(self) -> dict:
+        retry_in = 0.0
+        if self.state == "open":
+            retry_in = max(0.0, self.cooldown - (time.monotonic() - self.opened_at))
+        return {"state": self.state, "failures": self.failures, "retry_in": round(retry_in, 1)}
+
+
+class Channel:
+    """Everything one kind of Gemini call shares across the process."""
+
+    def __init__(self, name: str, rpm: int, tpm: int, concurrency: int):
+        self.name = name
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.concurrency = concurrency
+        self.slots = asyncio.Semaphore(concurrency)
+        self.breaker = CircuitBreaker(BREAKER_THRESHOLD, BREAKER_COOLDOWN)
+        self.in_flight = 0
+        self.calls = 0
+        self.retries = 0
+        self.failures = 0
+        self.rejected = 0
+        self.throttled_seconds = 0.0
+
+    def _breaker(self, step):
+        try:
+            step()
+        except CircuitOpen:
+            self.rejected += 1
+            metrics.GEMINI_ERRORS.inc(channel=self.name, kind="circuit_open")
+            raise
+
+    async def admit(self, tokens: int):
+        """
+        Breaker check, wait for rate-limit budget, then take the call.
+        A half-open trial is only taken once the budget is in hand, so a
+        caller cancelled while waiting never holds it.
+        """
+        self._breaker(self.breaker.check)
+        waited = await self.requests.acquire(1)
+        waited += await self.tokens.acquire(tokens)
+        self.throttled_seconds += waited
+        if waited:
+            metrics.observe_stage(f"gemini_{self.name}_rate_limited", waited)
+        self._breaker(self.breaker.before_call)
+
+    def failed(self, retryable: bool):
+        self.failures += 1
+        metrics.GEMINI_ERRORS.inc(
+            channel=self.name, kind="retryable" if retryable else "other"
+        )
+
+    def retrying(self):
+        self.retries += 1
+        metrics.GEMINI_RETRIES.inc(channel=self.name, endpoint=metrics.current_endpoint.get())
+
+    def has_spare_capacity(self, max_in_flight: int) -> bool:
+        """For background work: few calls in flight and the breaker not open."""
+        try:
+            self.breaker.check()
+        except CircuitOpen:
+            return False
+        return self.in_flight < max_in_flight
+
+    def state(self) -> dict:
+        return {
+            "breaker": self.breaker.snapshot(),
+            "requests_bucket": self.requests.state(),
+            "tokens_bucket": self.tokens.state(),
+            "in_flight": self.in_flight,
+            "concurrency": self.concurrency,
+            "calls": self.calls,
+            "retries": self.retries,
+            "failures": self.failures,
+            "rejected": self.rejected,
+            "throttled_seconds": round(self.throttled_seconds, 3),
+        }
+
+
+llm_channel = Channel("llm", LLM_RPM, LLM_TPM, LLM_MAX_CONCURRENCY)
+embed_channel = Channel("embed", EMBED_RPM, EMBED_TPM, EMBED_MAX_IN_FLIGHT)
+
+
+async def _call(channel: Channel, fn, tokens: int, max_retries: int):
+    """
+    Run `await fn()` through the channel: breaker, rate limits,
+    concurrency cap, and jittered retries on provider errors.
+    """
     for attempt in range(1, max_retries + 1):
+        await channel.admit(tokens)
         try:
-            response = model.generate_content(prompt)
-            return response.text
-        except Exception:
+            async with channel.slots:
+                channel.in_flight += 1
+                channel.calls += 1
+                try:
+                    with metrics.stage(f"gemini_{channel.name}"):
+                        result = await fn()
+                finally:
+                    channel.in_flight -= 1
+        except RETRYABLE as ex:
+            channel.breaker.record_failure()
+            channel.failed(retryable=True)
             if attempt == max_retries:
                 raise
-            time.sleep(1 + attempt)
+            channel.retrying()
+            logger.info(f"Gemini {channel.name} call failed ({ex!r}); retry {attempt}")
+            await asyncio.sleep(_backoff(attempt))
+        except asyncio.CancelledError:
+            channel.breaker.release()
+            raise
+        except Exception:
+            # the provider answered; the request itself was bad
+            channel.breaker.record_success()
+            channel.failed(retryable=False)
+            raise
+        else:
+            channel.breaker.record_success()
+            return result
+
+
+def warm_up():
+    """Per-process setup before the first request (blocking: run in a thread)."""
+    configure()
+    embedding_cache.open()
+
+
+def gemini_status() -> dict:
+    """Monitoring snapshot of the shared client layer."""
+    return {
+        "llm": llm_channel.state(),
+        "embed": embed_channel.state(),
+        "embedding_cache": embedding_cache.stats(),
+        "query_batcher": query_batcher.stats(),
+    }
+
+
+# ---------------------------
+# Provider calls (swapped for fake_gemini when GEMINI_BACKEND=fake)
+# ---------------------------
+async def _generate(prompt: str) -> str:
+    response = await llm_model().generate_content_async(prompt)
+    return response.text
+
 
-def embed_single(text):
+async def _generate_stream(prompt: str):
+    response = await llm_model().generate_content_async(prompt, stream=True)
+    async for chunk in response:
+        try:
+            text = chunk.text
+        except ValueError:
+            # chunk without text parts (e.g. safety/finish metadata)
+            continue
+        if text:
+            yield text
+
+
+async def embed_batch(texts: List[str]) -> List[List[float]]:
     """
-    Embed one text safely.
-    Always returns 1536-dim vector for text-embedding-004
+    Embed a batch of texts in ONE provider call.
+    Returns one vector per text, in the same order.
     """
-    result = genai.embed_content(
+    result = await genai.embed_content_async(
         model=EMBED_MODEL,
-        content=text,
+        content=list(texts),
     )
-    # Always single embedding
-    return result["embedding"]
+    vectors = result["embedding"]
+    if len(vectors) != len(texts):
+        raise RuntimeError(
+            f"Embedding batch returned {len(vectors)} vectors for {len(texts)} texts"
+        )
+    return vectors
+
+
+if GEMINI_BACKEND == "fake":
+    import fake_gemini
+
+    _generate = fake_gemini.generate
+    _generate_stream = fake_gemini.generate_stream
+    embed_batch = fake_gemini.embed_batch
+    logger.warning("GEMINI_BACKEND=fake: using local fake Gemini responses")
+
+
+async def call_llm_once(prompt: str, max_retries: int = LLM_MAX_RETRIES) -> str:
+    tokens = estimate_tokens(prompt)
+    metrics.PROMPT_TOKENS.observe(tokens, endpoint=metrics.current_endpoint.get())
+    text = await _call(llm_channel, lambda: _generate(prompt), tokens, max_retries)
+    metrics.observe_size("llm_response", len(text or ""))
+    return text
 
-def get_embeddings(texts, max_retries: int = 2):
+
+async def stream_llm(prompt: str, max_retries: int = LLM_MAX_RETRIES):
     """
-    Embed a LIST of texts.
-    Proper batching (one-by-one) so all vectors match.
-    Returns list of vectors of equal dimension.
+    Yield the answer text piece by piece as Gemini produces it.
+    Retries only happen before the first piece has been yielded; the
+    concurrency slot is held until the stream ends.
     """
-    configure()
+    channel = llm_channel
+    tokens = estimate_tokens(prompt)
+    metrics.PROMPT_TOKENS.observe(tokens, endpoint=metrics.current_endpoint.get())
+    for attempt in range(1, max_retries + 1):
+        await channel.admit(tokens)
+        started = False
+        try:
+            async with channel.slots:
+                channel.in_flight += 1
+                channel.calls += 1
+                t, sent = time.perf_counter(), 0
+                try:
+                    async for text in _generate_stream(prompt):
+                        if not started:
+                            metrics.observe_stage("gemini_llm_first_piece", time.perf_counter() - t)
+                        started = True
+                        sent += len(text)
+                        yield text
+                finally:
+                    channel.in_flight -= 1
+                    metrics.observe_stage("gemini_llm_stream", time.perf_counter() - t)
+                    if started:
+                        metrics.observe_size("llm_response", sent)
+        except RETRYABLE:
+            channel.breaker.record_failure()
+            channel.failed(retryable=True)
+            if started or attempt == max_retries:
+                raise
+            channel.retrying()
+            await asyncio.sleep(_backoff(attempt))
+        except Exception:
+            channel.breaker.record_success()
+            channel.failed(retryable=False)
+            raise
+        except BaseException:
+            # cancelled, or the consumer closed the stream
+            channel.breaker.release()
+            raise
+        else:
+            channel.breaker.record_success()
+            return
+
+
+# ---------------------------
+# Embedding cache (model + text hash → vector)
+# ---------------------------
+class EmbeddingCache:
+    """
+    Two tiers: an in-process LRU in front of an on-disk sqlite table.
+    Disk hits are promoted to memory; the disk tier evicts least
+    recently used rows once it grows past max_disk entries.
+
+    The memory tier has its own lock, held only for dict operations, so
+    lookups on the event loop never wait for a disk query or commit.
+    Disk errors (e.g. "database is locked" with several workers on one
+    file) are logged and treated as misses / skipped writes.
+    """
+
+    def __init__(self, max_entries: int, path: str, max_disk: int):
+        self.max_entries = max_entries
+        self.max_disk = max_disk
+        self._mem = OrderedDict()
+        self._mem_lock = threading.Lock()
+        self._disk_lock = threading.Lock()
+        self._path = path
+        self._db = None
+        self._db_pid = None
+        self._disk_disabled = not path
+        self._writes = 0
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.disk_errors = 0
+
+    def _connection(self):
+        """
+        This process's sqlite connection, opened on first use (call with
+        the disk lock held). A connection is never shared across a fork.
+        """
+        if self._disk_disabled:
+            return None
+        if self._db is None or self._db_pid != os.getpid():
+            try:
+                # a short busy timeout: a locked file is a miss, not a stall
+                self._db = sqlite3.connect(self._path, timeout=1.0, check_same_thread=False)
+                self._db_pid = os.getpid()
+                # WAL lets several worker processes read while one writes
+                self._db.execute("PRAGMA journal_mode=WAL")
+                self._db.execute(
+                    "CREATE TABLE IF NOT EXISTS embeddings ("
+                    " key TEXT PRIMARY KEY, vector BLOB NOT NULL, last_used REAL NOT NULL)"
+                )
+                self._db.execute(
+                    "CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings(last_used)"
+                )
+                self._db.commit()
+            except Exception as ex:
+                logger.warning(f"Embedding disk cache disabled ({self._path}): {ex}")
+                self._db = None
+                self._disk_disabled = True
+        return self._db
+
+    def _disk_failed(self, db, action: str, ex: Exception):
+        self.disk_errors += 1
+        logger.warning(f"Embedding disk cache {action} failed: {ex!r}")
+        try:
+            db.rollback()
+        except Exception:
+            pass
+
+    def open(self):
+        """Open the disk tier now (warm-up) instead of on the first lookup."""
+        with self._disk_lock:
+            self._connection()
+
+    @staticmethod
+    def key(model: str, text: str) -> str:
+        return hashlib.sha256(f"{model}\0{text}".encode("utf-8")).hexdigest()
+
+    def get_memory(self, keys):
+        """Return {key: vector} for the keys in the memory tier (no I/O)."""
+        found = {}
+        with self._mem_lock:
+            for k in keys:
+                v = self._mem.get(k)
+                if v is not None:
+                    self._mem.move_to_end(k)
+                    found[k] = v
+            self.memory_hits += len(found)
+        return found
+
+    def get_disk(self, keys):
+        """
+        Return {key: vector} for the keys in the disk tier (blocking I/O).
+        Keys not found here count as misses.
+        """
+        found = {}
+        with self._disk_lock:
+            db = self._connection()
+            if db is not None:
+                try:
+                    now = time.time()
+                    for i in range(0, len(keys), 500):
+                        part = keys[i:i + 500]
+                        rows = db.execute(
+                            f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(part))})",
+                            part,
+                        ).fetchall()
+                        for k, blob in rows:
+                            found[k] = array("f", blob).tolist()
+                        if rows:
+                            db.executemany(
+                                "UPDATE embeddings SET last_used = ? WHERE key = ?",
+                                [(now, k) for k, _ in rows],
+                            )
+                    db.commit()
+                except sqlite3.Error as ex:
+                    # rows read before the error are still good
+                    self._disk_failed(db, "read", ex)
+
+        with self._mem_lock:
+            for k, v in found.items():
+                self._put_mem(k, v)
+            self.disk_hits += len(found)
+            self.misses += len(keys) - len(found)
+        return found
+
+    @property
+    def has_disk(self) -> bool:
+        return not self._disk_disabled
+
+    def put_many(self, items):
+        """items: iterable of (key, vector)."""
+        items = list(items)
+        if not items:
+            return
+        with self._mem_lock:
+            for k, v in items:
+                self._put_mem(k, v)
+        if self._disk_disabled:
+            return
+        with self._disk_lock:
+            db = self._connection()
+            if db is None:
+                return
+            try:
+                now = time.time()
+                db.executemany(
+                    "INSERT OR REPLACE INTO embeddings (key, vector, last_used) VALUES (?, ?, ?)",
+                    [(k, array("f", v).tobytes(), now) for k, v in items],
+                )
+                self._writes += len(items)
+                if self._writes >= 1000:
+                    self._writes = 0
+                    self._evict_disk(db)
+                db.commit()
+            except sqlite3.Error as ex:
+                self._disk_failed(db, "write", ex)
+
+    def _put_mem(self, k, v):
+        # call with the memory lock held
+        self._mem[k] = v
+        self._mem.move_to_end(k)
+        while len(self._mem) > self.max_entries:
+            self._mem.popitem(last=False)
+
+    def _evict_disk(self, db):
+        (count,) = db.execute("SELECT COUNT(*) FROM embeddings").fetchone()
+        extra = count - self.max_disk
+        if extra > 0:
+            db.execute(
+                "DELETE FROM embeddings WHERE key IN "
+                "(SELECT key FROM embeddings ORDER BY last_used LIMIT ?)",
+                (extra,),
+            )
+
+    def stats(self) -> dict:
+        lookups = self.memory_hits + self.disk_hits + self.misses
+        return {
+            "memory_entries": len(self._mem),
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "disk_errors": self.disk_errors,
+            "hit_rate": (self.memory_hits + self.disk_hits) / lookups if lookups else 0.0,
+        }
+
+
+embedding_cache = EmbeddingCache(EMBED_CACHE_SIZE, EMBED_CACHE_PATH, EMBED_DISK_CACHE_MAX)
+
+
+@dataclass
+class EmbeddingResult:
+    """
+    vectors[i] is the embedding of texts[i], or None if that text failed.
+    failed lists the indices that could not be embedded.
+    """
+    vectors: List[Optional[List[float]]]
+    failed: List[int] = field(default_factory=list)
 
+    @property
+    def ok(self) -> bool:
+        return not self.failed
+
+
+async def _embed_batch_with_retry(texts: List[str], max_retries: int):
+    tokens = sum(estimate_tokens(t) for t in texts)
+    metrics.EMBED_BATCH_TEXTS.observe(len(texts), endpoint=metrics.current_endpoint.get())
+    try:
+        return await _call(embed_channel, lambda: embed_batch(texts), tokens, max_retries)
+    except Exception as ex:
+        logger.warning(f"Embedding batch of {len(texts)} failed: {ex!r}")
+        return None
+
+
+async def embed_texts(
+    texts,
+    batch_size: int = EMBED_BATCH_SIZE,
+    max_retries: int = EMBED_MAX_RETRIES,
+) -> EmbeddingResult:
+    """
+    Embed a LIST of texts in provider-sized batches.
+    Cached texts (and repeats within the list) are never sent to the API.
+    Batches go through the embed channel (at most EMBED_MAX_IN_FLIGHT at
+    once); each is retried on its own, so one bad batch does not sink the rest.
+    """
     if isinstance(texts, str):
         texts = [texts]
+    texts = list(texts)
 
-    embeddings = []
+    vectors: List[Optional[List[float]]] = [None] * len(texts)
+    if not texts:
+        return EmbeddingResult(vectors)
 
-    for t in texts:
-        for attempt in range(1, max_retries + 1):
-            try:
-                emb = embed_single(t)
-                embeddings.append(emb)
-                break
-            except Exception:
-                if attempt == max_retries:
-                    raise
-                time.sleep(1 + attempt)
-
-    return embeddings
+    started = time.perf_counter()
+    keys = [EmbeddingCache.key(EMBED_MODEL, t) for t in texts]
+    unique = list(dict.fromkeys(keys))
+    cached = embedding_cache.get_memory(unique)
+    missing = [k for k in unique if k not in cached]
+    if missing:
+        if embedding_cache.has_disk:
+            cached.update(await asyncio.to_thread(embedding_cache.get_disk, missing))
+        else:
+            embedding_cache.get_disk(missing)
+    metrics.observe_stage("embed_cache_lookup", time.perf_counter() - started)
+
+    # unique uncached texts, in first-seen order
+    todo_keys, todo_texts, seen = [], [], set()
+    for k, t in zip(keys, texts):
+        if k not in cached and k not in seen:
+            seen.add(k)
+            todo_keys.append(k)
+            todo_texts.append(t)
+
+    fresh = {}
+    if todo_texts:
+        configure()
+        spans = [
+            (i, min(i + batch_size, len(todo_texts)))
+            for i in range(0, len(todo_texts), batch_size)
+        ]
+        results = await asyncio.gather(
+            *[_embed_batch_with_retry(todo_texts[s:e], max_retries) for s, e in spans]
+        )
+
+        for (s, e), batch_vectors in zip(spans, results):
+            if batch_vectors is not None:
+                fresh.update(zip(todo_keys[s:e], batch_vectors))
+        if fresh:
+            await asyncio.to_thread(embedding_cache.put_many, list(fresh.items()))
+
+    failed = []
+    for i, k in enumerate(keys):
+        v = cached.get(k) or fresh.get(k)
+        if v is None:
+            failed.append(i)
+        vectors[i] = v
+
+    metrics.observe_stage("embedding", time.perf_counter() - started)
+    return EmbeddingResult(vectors, failed)
+
+
+def _embedding_failure(failed: int, total: int) -> Exception:
+    if embed_channel.breaker.state == "open":
+        return CircuitOpen("Gemini is unavailable, try again shortly.")
+    return RuntimeError(f"Failed to embed {failed} of {total} texts")
+
+
+async def get_embeddings(texts, max_retries: int = EMBED_MAX_RETRIES):
+    """
+    Embed a LIST of texts.
+    Returns list of vectors of equal dimension, in input order.
+    Raises if any text could not be embedded.
+    """
+    result = await embed_texts(texts, max_retries=max_retries)
+    if result.failed:
+        raise _embedding_failure(len(result.failed), len(result.vectors))
+    return result.vectors
+
+
+class QueryBatcher:
+    """
+    Coalesces single query embeddings: requests arriving within `window_ms`
+    of the first one (or until `max_batch` are waiting) go out as one
+    embed_texts call, and each caller gets its own vector back.
+    """
+
+    def __init__(self, window_ms: float, max_batch: int):
+        self.window = window_ms / 1000
+        self.max_batch = max(1, max_batch)
+        self._pending = []
+        self._timer = None
+        self._tasks = set()
+        self.queries = 0
+        self.batches = 0
+
+    async def embed(self, text: str) -> List[float]:
+        loop = asyncio.get_running_loop()
+        fut = loop.create_future()
+        self._pending.append((text, fut))
+        if len(self._pending) >= self.max_batch:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window, self._flush)
+        return await fut
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if not batch:
+            return
+        self.queries += len(batch)
+        self.batches += 1
+        task = asyncio.ensure_future(self._run(batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, batch):
+        try:
+            result = await embed_texts([text for text, _ in batch])
+        except asyncio.CancelledError:
+            for _, fut in batch:
+                fut.cancel()
+            raise
+        except Exception as ex:
+            for _, fut in batch:
+                if not fut.done():
+                    fut.set_exception(ex)
+            return
+        for (_, fut), vector in zip(batch, result.vectors):
+            if fut.done():
+                continue  # caller went away
+            if vector is None:
+                fut.set_exception(_embedding_failure(1, 1))
+            else:
+                fut.set_result(vector)
+
+    def stats(self) -> dict:
+        return {
+            "window_ms": self.window * 1000,
+            "queries": self.queries,
+            "batches": self.batches,
+            "avg_batch": self.queries / self.batches if self.batches else 0.0,
+        }
+
+
+query_batcher = QueryBatcher(EMBED_QUERY_BATCH_MS, EMBED_QUERY_BATCH_MAX)
+
+
+async def embed_query(text: str) -> List[float]:
+    """
+    Embedding of one query (chat question, retrieval query). Cached
+    queries return at once; the rest are micro-batched with concurrent ones.
+    """
+    if EMBED_QUERY_BATCH_MS <= 0:
+        return (await get_embeddings([text]))[0]
+    cached = embedding_cache.get_memory([EmbeddingCache.key(EMBED_MODEL, text)])
+    if cached:
+        return next(iter(cached.values()))
+    return await query_batcher.embed(text)
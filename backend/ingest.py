@@ -0,0 +1,287 @@
+# ingest.py
+import os
+import time
+import asyncio
+import logging
+from datetime import datetime
+from typing import List
+
+import numpy as np
+from starlette.concurrency import iterate_in_threadpool
+
+import metrics
+from chunker import iter_chunks
+from lexical import analyze
+from database import documents_collection, chunks_collection, chunk_record
+from gemini_client import embed_texts, EMBED_BATCH_SIZE, EMBED_MAX_IN_FLIGHT
+from jobs import JobError, update_job
+from pdf_extract import iter_pdf_pages, page_count
+from rag import add_chunks_to_chroma, delete_document
+from selection import select_representatives
+
+# chunks embedded + indexed per step while the PDF is still being read
+INGEST_STEP_CHUNKS = EMBED_BATCH_SIZE * EMBED_MAX_IN_FLIGHT
+
+logger = logging.getLogger("backend.ingest")
+
+
+# ---------------------------
+# Content-addressed dedupe
+# ---------------------------
+async def find_indexed_copy(content_hash: str):
+    """
+    Return an already-indexed document with the same file content, if any.
+    """
+    return await documents_collection.find_one(
+        {"content_hash": content_hash, "chroma_indexed": True},
+        {
+            "_id": 0,
+            "doc_id": 1,
+            "index_doc_id": 1,
+            "pages_count": 1,
+            "chunks_count": 1,
+            "representative_chunks": 1,
+        },
+    )
+
+
+async def create_from_copy(doc_id: str, filename: str, content_hash: str, source: dict):
+    """
+    New document record that shares chunks + Chroma entries of `source`.
+    Only metadata is written; nothing is extracted or embedded.
+    """
+    index_doc_id = source.get("index_doc_id") or source["doc_id"]
+    await documents_collection.insert_one(
+        {
+            "doc_id": doc_id,
+            "filename": filename,
+            "content_hash": content_hash,
+            "index_doc_id": index_doc_id,
+            "pages_count": source.get("pages_count", 0),
+            "chunks_count": source.get("chunks_count"),
+            "representative_chunks": source.get("representative_chunks"),
+            "chroma_indexed": True,
+            "llm_output": {},
+            "created_at": datetime.utcnow(),
+        }
+    )
+    logger.info(f"Deduplicated {filename} → doc_id={doc_id} (index={index_doc_id})")
+
+
+# ---------------------------
+# Ingestion job (runs on a jobs worker)
+# ---------------------------
+async def discard_partial(doc_id: str):
+    """Remove the chunks and vectors a failed ingest already wrote."""
+    try:
+        with metrics.stage("mongo_write"):
+            await chunks_collection.delete_many({"doc_id": doc_id})
+        await delete_document(doc_id)
+    except Exception as ex:
+        logger.warning(f"Cleanup after failed ingest of doc_id={doc_id} failed: {ex!r}")
+
+
+async def _embed_and_index(doc_id: str, filename: str, chunks: List[dict]):
+    """
+    Embed a step of chunks and add the successful ones to Chroma.
+    Returns (seqs indexed, their vectors as float32 rows, ids of chunks
+    that failed to embed).
+    """
+    texts = [c["text"] for c in chunks]
+    try:
+        result = await embed_texts(texts)
+    except Exception as ex:
+        logger.warning(f"Embedding generation failed: {ex}")
+        return [], None, [c["id"] for c in chunks]
+
+    keep = [i for i, v in enumerate(result.vectors) if v is not None]
+    if keep:
+        await add_chunks_to_chroma(
+            doc_id,
+            [chunks[i]["id"] for i in keep],
+            [texts[i] for i in keep],
+            [result.vectors[i] for i in keep],
+            [
+                {
+                    "doc_filename": filename,
+                    "start": chunks[i]["start"],
+                    "end": chunks[i]["end"],
+                    "page_start": chunks[i]["page_start"],
+                    "page_end": chunks[i]["page_end"],
+                }
+                for i in keep
+            ],
+        )
+    failed = [chunks[i]["id"] for i in result.failed]
+    if not keep:
+        return [], None, failed
+    vectors = np.asarray([result.vectors[i] for i in keep], dtype=np.float32)
+    return [int(chunks[i]["id"]) for i in keep], vectors, failed
+
+
+def _chunk_steps(save_path: str, progress: dict, timings: dict):
+    """
+    Blocking: read pages + chunk them, yielding lists of up to
+    INGEST_STEP_CHUNKS chunks. progress tracks pages read, whether any
+    page had text, and "done" once every page is read and chunked (set
+    before the last step is yielded). timings collects seconds spent
+    extracting and chunking (incl. analysis for the lexical index).
+    """
+    def pages():
+        pages_iter = iter_pdf_pages(save_path)
+        while True:
+            t = time.perf_counter()
+            text = next(pages_iter, None)
+            timings["pdf_extract"] += time.perf_counter() - t
+            if text is None:
+                return
+            progress["pages_read"] += 1
+            if text.strip():
+                progress["has_text"] = True
+            yield text
+
+    step = []
+    t = time.perf_counter()
+    for c in iter_chunks(pages()):
+        # BM25 term frequencies, stored with the chunk
+        c["terms"], c["length"] = analyze(c["text"])
+        step.append(c)
+        if len(step) >= INGEST_STEP_CHUNKS:
+            timings["work"] += time.perf_counter() - t
+            yield step
+            step = []
+            t = time.perf_counter()
+    timings["work"] += time.perf_counter() - t
+    progress["done"] = True
+    if step:
+        yield step
+
+
+async def run_ingest(
+    job_id: str, doc_id: str, save_path: str, filename: str, content_hash: str
+):
+    """
+    extract → chunk → embed → index → store document record.
+    Pages stream from the (parallel) extractor into the chunker on a
+    thread, and chunks are embedded + indexed in steps while the PDF is
+    still read. Progress (pages read, chunks chunked / embedded so far)
+    is written to the job after every step; a stage is recorded when it
+    completes for the whole document.
+    """
+    metrics.current_endpoint.set("ingest")
+    stored = False
+    try:
+        # an identical upload may have finished while this one was queued
+        source = await find_indexed_copy(content_hash)
+        if source:
+            await create_from_copy(doc_id, filename, content_hash, source)
+            stored = True
+            await update_job(job_id, stage="indexed", chroma_indexed=True, deduplicated=True)
+            return
+
+        pages_count = await asyncio.to_thread(page_count, save_path)
+        progress = {"pages_read": 0, "has_text": False, "done": False}
+        await update_job(
+            job_id, stage="extracting", pages_count=pages_count,
+            pages_read=0, chunks_count=0, chunks_embedded=0, embed_failed=0,
+        )
+
+        failed_ids = []
+        chunks_count = 0
+        embedded_count = 0
+        read_reported = False
+        # vectors of indexed chunks, kept to pick representative chunks
+        vec_seqs, vec_blocks = [], []
+
+        async def report_read():
+            await update_job(job_id, stage="extracted", pages_read=progress["pages_read"])
+            await update_job(job_id, stage="chunked", chunks_count=chunks_count)
+
+        timings = {"pdf_extract": 0.0, "work": 0.0}
+        steps = _chunk_steps(save_path, progress, timings)
+        async for step in iterate_in_threadpool(steps):
+            chunks_count += len(step)
+            with metrics.stage("mongo_write"):
+                await chunks_collection.insert_many([chunk_record(doc_id, c) for c in step])
+            if progress["done"] and not read_reported:
+                # the last step: every page is read and chunked
+                await report_read()
+                read_reported = True
+            else:
+                await update_job(
+                    job_id, pages_read=progress["pages_read"], chunks_count=chunks_count
+                )
+
+            seqs, vectors, failed = await _embed_and_index(doc_id, filename, step)
+            failed_ids.extend(failed)
+            embedded_count += len(seqs)
+            if seqs:
+                vec_seqs.extend(seqs)
+                vec_blocks.append(vectors)
+            await update_job(
+                job_id, chunks_embedded=embedded_count, embed_failed=len(failed_ids)
+            )
+
+        metrics.observe_stage("pdf_extract", timings["pdf_extract"])
+        metrics.observe_stage("chunking", timings["work"] - timings["pdf_extract"])
+
+        if not progress["has_text"]:
+            raise JobError("PDF contains no readable text.")
+        if not chunks_count:
+            raise JobError("No substantial text after chunking.")
+        if not read_reported:
+            await report_read()
+
+        if failed_ids:
+            logger.warning(
+                f"Embedding failed for {len(failed_ids)} of {chunks_count} chunks; "
+                "indexed the rest."
+            )
+        await update_job(
+            job_id, stage="embedded", chunks_embedded=embedded_count, embed_failed=len(failed_ids)
+        )
+        chroma_indexed = bool(vec_seqs)
+
+        # coverage set for summary/notes, from the vectors we already have
+        representative = []
+        if vec_seqs:
+            with metrics.stage("selection"):
+                representative = await asyncio.to_thread(
+                    select_representatives, vec_seqs, np.vstack(vec_blocks)
+                )
+        vec_blocks.clear()
+
+        await documents_collection.insert_one(
+            {
+                "doc_id": doc_id,
+                "filename": filename,
+                "content_hash": content_hash,
+                "pages_count": pages_count,
+                "chroma_indexed": chroma_indexed,
+                "embedding_failed_ids": failed_ids,
+                "chunks_count": chunks_count,
+                "representative_chunks": representative,
+                "llm_output": {},
+                "created_at": datetime.utcnow(),
+            }
+        )
+        stored = True
+        await update_job(job_id, stage="indexed", chroma_indexed=chroma_indexed)
+
+        logger.info(
+            f"Ingested {filename} → doc_id={doc_id} "
+            f"(chunks={chunks_count}, embed_failed={len(failed_ids)}, "
+            f"chroma_indexed={chroma_indexed})"
+        )
+
+    except BaseException:
+        # failed or cancelled before the document record existed: nothing
+        # would ever reach (or delete) what was written so far
+        if not stored:
+            await discard_partial(doc_id)
+        raise
+    finally:
+        try:
+            os.unlink(save_path)
+        except Exception:
+            pass
@@ -0,0 +1,154 @@
+# jobs.py
+import os
+import uuid
+import asyncio
+import logging
+from datetime import datetime
+
+from database import jobs_collection
+
+# how many ingestion jobs run at once
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "2"))
+# running + waiting jobs; beyond this /upload is refused
+INGEST_QUEUE_MAX = int(os.getenv("INGEST_QUEUE_MAX", "8"))
+# workers for low-priority background tasks (artifact pre-generation)
+BACKGROUND_WORKERS = int(os.getenv("BACKGROUND_WORKERS", "1"))
+
+logger = logging.getLogger("backend.jobs")
+
+_queue: asyncio.Queue = asyncio.Queue()
+_background: asyncio.Queue = asyncio.Queue()
+_workers = []
+# reserved slots (uploads being received + queued + running jobs)
+_reserved = 0
+
+
+class QueueFull(Exception):
+    pass
+
+
+class JobError(Exception):
+    """Expected failure inside a job; the message is shown to the user."""
+    pass
+
+
+def reserve_slot():
+    """
+    Reserve a queue slot before the upload is copied and queued.
+    Raises QueueFull if the queue is at capacity. This bounds queued and
+    running jobs only: Starlette has already received and spooled the
+    whole multipart body by the time the endpoint runs.
+    """
+    global _reserved
+    if _reserved >= INGEST_QUEUE_MAX:
+        raise QueueFull("Ingestion queue is full, try again shortly.")
+    _reserved += 1
+
+
+def release_slot():
+    global _reserved
+    _reserved = max(0, _reserved - 1)
+
+
+async def create_job(kind: str, doc_id: str, **fields) -> str:
+    job_id = str(uuid.uuid4())
+    now = datetime.utcnow()
+    await jobs_collection.insert_one(
+        {
+            "job_id": job_id,
+            "kind": kind,
+            "doc_id": doc_id,
+            "status": "queued",
+            "stage": "queued",
+            "stages": {"queued": now},
+            "error": None,
+            "created_at": now,
+            "updated_at": now,
+            **fields,
+        }
+    )
+    return job_id
+
+
+async def update_job(job_id: str, stage: str = None, **fields):
+    now = datetime.utcnow()
+    update = {"updated_at": now, **fields}
+    if stage:
+        update["stage"] = stage
+        update[f"stages.{stage}"] = now
+    await jobs_collection.update_one({"job_id": job_id}, {"$set": update})
+
+
+async def get_job(job_id: str):
+    return await jobs_collection.find_one({"job_id": job_id}, {"_id": 0})
+
+
+async def _run(job_id: str, fn, args):
+    try:
+        await update_job(job_id, status="running")
+        await fn(job_id, *args)
+        await update_job(job_id, stage="done", status="done")
+    except JobError as ex:
+        await update_job(job_id, status="failed", error=str(ex))
+    except Exception as ex:
+        logger.exception(f"Job {job_id} failed")
+        await update_job(job_id, status="failed", error=f"Internal error: {ex}")
+    finally:
+        release_slot()
+
+
+async def _worker():
+    while True:
+        job_id, fn, args = await _queue.get()
+        try:
+            await _run(job_id, fn, args)
+        except Exception:
+            # status updates themselves failed; keep the worker alive
+            logger.exception(f"Job {job_id} could not record its outcome")
+        finally:
+            _queue.task_done()
+
+
+async def _background_worker():
+    while True:
+        fn, args = await _background.get()
+        try:
+            await fn(*args)
+        except Exception:
+            logger.exception(f"Background task {fn.__name__} failed")
+        finally:
+            _background.task_done()
+
+
+def start_workers():
+    """Start the ingestion and background workers on the running event loop."""
+    if _workers:
+        return
+    for _ in range(INGEST_WORKERS):
+        _workers.append(asyncio.create_task(_worker()))
+    for _ in range(BACKGROUND_WORKERS):
+        _workers.append(asyncio.create_task(_background_worker()))
+
+
+async def stop_workers():
+    for task in _workers:
+        task.cancel()
+    await asyncio.gather(*_workers, return_exceptions=True)
+    _workers.clear()
+
+
+def submit(job_id: str, fn, *args):
+    """
+    Queue `await fn(job_id, *args)` for the workers.
+    The caller must already hold a slot from reserve_slot(); it is
+    released when the job finishes, whatever the outcome.
+    """
+    _queue.put_nowait((job_id, fn, args))
+
+
+def submit_background(fn, *args):
+    """
+    Queue `await fn(*args)` for the background workers. No slot, no job
+    record: the task reports its own progress.
+    """
+    _background.put_nowait((fn, args))
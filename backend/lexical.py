@@ -0,0 +1,138 @@
+# lexical.py
+"""
+BM25 over a document's chunks.
+
+Term frequencies are computed once at upload and stored on each chunk
+record (`terms`, `length`). At query time the postings of a document are
+loaded into a small in-process LRU, so a keyword lookup costs no
+embedding call and no vector search.
+"""
+import os
+import re
+import math
+import asyncio
+from array import array
+from collections import Counter, OrderedDict
+from typing import Dict, List, Tuple
+
+import singleflight
+from database import chunks_collection
+
+# documents whose postings stay in memory
+LEXICAL_CACHE_DOCS = int(os.getenv("LEXICAL_CACHE_DOCS", "32"))
+BM25_K1 = 1.5
+BM25_B = 0.75
+# scoring a big document takes milliseconds: do it off the event loop
+THREAD_MIN_CHUNKS = 2000
+
+_TOKEN = re.compile(r"[a-z0-9]+")
+STOPWORDS = frozenset(
+    """
+    a an and are as at be been but by can do does for from had has have how i if in
+    into is it its of on or our so than that the their them then there these they
+    this to was we were what when where which while who why will with would you your
+    about also any each explain describe define give tell me please between did
+    """.split()
+)
+
+
+def tokenize(text: str) -> List[str]:
+    return [t for t in _TOKEN.findall(text.lower()) if len(t) > 1 and t not in STOPWORDS]
+
+
+def analyze(text: str) -> Tuple[Dict[str, int], int]:
+    """(term → frequency, token count) for one chunk."""
+    tokens = tokenize(text)
+    return dict(Counter(tokens)), len(tokens)
+
+
+class LexicalIndex:
+    """In-memory postings for one document: term → (chunk seqs, tfs)."""
+
+    def __init__(self, rows):
+        postings: Dict[str, Tuple[List[int], List[int]]] = {}
+        self.lengths: Dict[int, int] = {}
+        for seq, terms, length in rows:
+            self.lengths[seq] = length
+            for term, tf in terms.items():
+                p = postings.get(term)
+                if p is None:
+                    p = postings[term] = ([], [])
+                p[0].append(seq)
+                p[1].append(tf)
+        # compact arrays: a large PDF has ~1M postings
+        self.postings = {t: (array("I", s), array("I", f)) for t, (s, f) in postings.items()}
+        self.n = len(self.lengths)
+        self.avgdl = (sum(self.lengths.values()) / self.n) if self.n else 0.0
+        # BM25 length normalisation per chunk, precomputed
+        avgdl = self.avgdl or 1.0
+        self._norm = {
+            seq: BM25_K1 * (1 - BM25_B + BM25_B * length / avgdl)
+            for seq, length in self.lengths.items()
+        }
+
+    def search(self, query: str, k: int) -> List[Tuple[int, float]]:
+        """Top-k (seq, score) by BM25, best first."""
+        if not self.n:
+            return []
+        scores: Dict[int, float] = {}
+        for term in set(tokenize(query)):
+            p = self.postings.get(term)
+            if p is None:
+                continue
+            seqs, tfs = p
+            df = len(seqs)
+            idf = math.log(1 + (self.n - df + 0.5) / (df + 0.5))
+            norm = self._norm
+            for seq, tf in zip(seqs, tfs):
+                scores[seq] = scores.get(seq, 0.0) + idf * tf * (BM25_K1 + 1) / (tf + norm[seq])
+        best = sorted(scores.items(), key=lambda kv: -kv[1])
+        return best[:k]
+
+
+_cache: "OrderedDict[str, LexicalIndex]" = OrderedDict()
+
+
+async def _load(doc_id: str) -> LexicalIndex:
+    rows, legacy = [], []
+    cursor = chunks_collection.find(
+        {"doc_id": doc_id}, {"_id": 0, "seq": 1, "terms": 1, "length": 1}
+    )
+    async for r in cursor:
+        if r.get("terms") is not None:
+            rows.append((r["seq"], r["terms"], r.get("length", 0)))
+        else:
+            legacy.append(r["seq"])
+
+    if legacy:
+        # chunks stored before term frequencies were: analyze their text now
+        cursor = chunks_collection.find(
+            {"doc_id": doc_id, "seq": {"$in": legacy}}, {"_id": 0, "seq": 1, "text": 1}
+        )
+        async for r in cursor:
+            terms, length = analyze(r.get("text") or "")
+            rows.append((r["seq"], terms, length))
+
+    index = await asyncio.to_thread(LexicalIndex, rows)
+    # an index with no chunks is not cached: the document may still be ingesting
+    if index.n:
+        _cache[doc_id] = index
+        while len(_cache) > LEXICAL_CACHE_DOCS:
+            _cache.popitem(last=False)
+    return index
+
+
+async def get_index(doc_id: str) -> LexicalIndex:
+    """The document's index, loaded once and kept in an LRU."""
+    index = _cache.get(doc_id)
+    if index is not None:
+        _cache.move_to_end(doc_id)
+        return index
+    return await singleflight.local(f"lexical:{doc_id}", lambda: _load(doc_id))
+
+
+async def search(doc_id: str, query: str, k: int) -> List[Tuple[int, float]]:
+    index = await get_index(doc_id)
+    if index.n >= THREAD_MIN_CHUNKS:
+        return await asyncio.to_thread(index.search, query, k)
+    return index.search(query, k)
@@ -1,74 +1,127 @@
 from dotenv import load_dotenv
 load_dotenv()
 
-from fastapi import FastAPI, UploadFile, File, HTTPException
+from fastapi import FastAPI, UploadFile, File, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 import os
+import time
+import asyncio
 import tempfile
 import uuid
+import hashlib
 import logging
+from contextlib import asynccontextmanager
 from datetime import datetime
-import fitz  # PyMuPDF
+from typing import Optional
 import json
-from typing import List
 
-from database import documents_collection
-from gemini_client import call_llm_once, get_embeddings
-from rag import add_chunks_to_chroma, query_similar_chunks
+import answer_cache
+import database
+import gemini_client
+import jobs
+import mapreduce
+import metrics
+import rag
+import singleflight
+import vector_cache
+from context import pack_context, CONTEXT_BUDGETS
+from database import documents_collection, ensure_indexes
+from gemini_client import (
+    call_llm_once,
+    stream_llm,
+    gemini_status,
+    CircuitOpen,
+    BREAKER_COOLDOWN,
+    LLM_MODEL,
+    LLM_MAX_CONCURRENCY,
+    llm_channel,
+    embed_query,
+)
+from ingest import run_ingest, find_indexed_copy, create_from_copy
+from retrieval import retrieve, fetch_chunks, spread_hits, is_keyword_query, MODES
+from selection import representatives_from_index
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger("backend")
 
-app = FastAPI(title="ProjectTutor API (RAG-first)")
-
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
-
 # ---------------------------
-# PDF extract & chunk helpers
+# Process lifecycle
 # ---------------------------
-def extract_text_pages_from_pdf(path: str) -> List[str]:
-    doc = fitz.open(path)
-    return [(doc[p].get_text("text") or "") for p in range(len(doc))]
+# Nothing connects at import: each worker process opens its own Mongo,
+# Chroma and sqlite clients in warm-up (or on first use), so forked
+# uvicorn/gunicorn workers never share a connection.
+WARMUP_RETRY_SECONDS = float(os.getenv("WARMUP_RETRY_SECONDS", "5"))
+READY_CHECK_TIMEOUT = float(os.getenv("READY_CHECK_TIMEOUT", "2"))
+
+_ready = asyncio.Event()
+_warmup_task = None
+
+
+async def warm_up():
+    """Open every client and make sure the indexes exist."""
+    t = time.perf_counter()
+    await ensure_indexes()
+    await rag.warm_up()
+    await asyncio.to_thread(gemini_client.warm_up)
+    _ready.set()
+    logger.info(f"Worker {os.getpid()} ready in {time.perf_counter() - t:.2f} s")
+
+
+async def _warm_up_until_ready():
+    # a dependency that is down at boot must not kill the worker:
+    # stay alive (not ready) and retry
+    while True:
+        try:
+            await warm_up()
+            return
+        except Exception as ex:
+            logger.warning(f"Warm-up failed, retrying in {WARMUP_RETRY_SECONDS:g} s: {ex!r}")
+            await asyncio.sleep(WARMUP_RETRY_SECONDS)
 
 
-def chunk_text_from_pages(pages: List[str], chunk_size=1000, overlap=200):
-    text = "\n\n".join(pages)
-    L = len(text)
-    chunks, start, cid = [], 0, 0
+async def startup():
+    global _warmup_task
+    jobs.start_workers()
+    _warmup_task = asyncio.create_task(_warm_up_until_ready())
 
-    while start < L:
-        end = start + chunk_size
-        part = text[start:end]
 
-        if end < L:
-            back = max(part.rfind("\n"), part.rfind(" "), part.rfind("."))
-            if back > int(chunk_size * 0.3):
-                end = start + back + 1
-                part = text[start:end]
+async def shutdown():
+    if _warmup_task is not None:
+        _warmup_task.cancel()
+    await jobs.stop_workers()
+    await database.close_client()
+    rag.shutdown()
 
-        part = part.strip()
-        if part:
-            chunks.append(
-                {
-                    "id": str(cid),
-                    "text": part,
-                    "start": start,
-                    "end": min(end, L),
-                }
-            )
-            cid += 1
 
-        start = max(0, end - overlap)
-        if end >= L:
-            break
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await startup()
+    try:
+        yield
+    finally:
+        await shutdown()
 
-    return chunks
 
+app = FastAPI(title="ProjectTutor API (RAG-first)", lifespan=lifespan)
+
+app.add_middleware(
+    CORSMiddleware,
+    allow_origins=["*"],
+    allow_methods=["*"],
+    allow_headers=["*"],
+)
+app.add_middleware(metrics.MetricsMiddleware)
+
+
+@app.exception_handler(CircuitOpen)
+async def circuit_open(request: Request, ex: CircuitOpen):
+    # fail fast while Gemini is down instead of piling up retries
+    return JSONResponse(
+        {"detail": str(ex)},
+        status_code=503,
+        headers={"Retry-After": str(int(BREAKER_COOLDOWN))},
+    )
 
 # ---------------------------
 # Prompt templates (ESCAPED)
@@ -191,6 +244,11 @@ Question:
 # JSON extraction helper
 # ---------------------------
 def extract_json_from_text(raw: str):
+    with metrics.stage("json_parse"):
+        return _parse_json(raw)
+
+
+def _parse_json(raw: str):
     import re
 
     if not raw:
@@ -220,106 +278,329 @@ def extract_json_from_text(raw: str):
 
 
 # ---------------------------
-# UPLOAD (RAG only)
+# UPLOAD (queued → background ingestion)
 # ---------------------------
+UPLOAD_READ_CHUNK = 1024 * 1024
+
+
 @app.post("/upload")
-async def upload(file: UploadFile = File(...)):
+async def upload(file: UploadFile = File(...), pregenerate: Optional[bool] = None):
     if not file.filename.lower().endswith(".pdf"):
         raise HTTPException(400, "Only PDF files allowed.")
 
-    tmp = tempfile.NamedTemporaryFile(delete=False, suffix=".pdf")
-    save_path = tmp.name
-    tmp.write(await file.read())
-    tmp.close()
+    try:
+        jobs.reserve_slot()
+    except jobs.QueueFull as ex:
+        raise HTTPException(503, str(ex))
 
+    save_path = None
+    submitted = False
     try:
-        pages = extract_text_pages_from_pdf(save_path)
-        if not pages or all(not p.strip() for p in pages):
-            raise HTTPException(400, "PDF contains no readable text.")
+        tmp = tempfile.NamedTemporaryFile(delete=False, suffix=".pdf")
+        save_path = tmp.name
+        sha = hashlib.sha256()
+        size = 0
+        try:
+            with metrics.stage("upload_receive"):
+                while True:
+                    block = await file.read(UPLOAD_READ_CHUNK)
+                    if not block:
+                        break
+                    sha.update(block)
+                    tmp.write(block)
+                    size += len(block)
+        finally:
+            tmp.close()
+        metrics.observe_size("pdf", size)
+
+        content_hash = sha.hexdigest()
+        doc_id = str(uuid.uuid4())
 
-        pages_count = len(pages)
-        chunks = chunk_text_from_pages(pages, 1000, 200)
-        if not chunks:
-            raise HTTPException(400, "No substantial text after chunking.")
+        # byte-identical PDF already indexed → reuse its chunks/embeddings
+        with metrics.stage("mongo_read"):
+            source = await find_indexed_copy(content_hash)
+        if pregenerate is None:
+            pregenerate = PREGENERATE
+        if source:
+            await create_from_copy(doc_id, file.filename, content_hash, source)
+            if pregenerate:
+                await queue_pregeneration(doc_id)
+            return {"status": "ok", "doc_id": doc_id, "deduplicated": True}
+
+        job_id = await jobs.create_job("ingest", doc_id, filename=file.filename)
+        jobs.submit(
+            job_id, ingest_job, doc_id, save_path, file.filename, content_hash, pregenerate
+        )
+        submitted = True
+    finally:
+        if not submitted:
+            jobs.release_slot()
+            if save_path:
+                try:
+                    os.unlink(save_path)
+                except Exception:
+                    pass
 
-        texts = [c["text"] for c in chunks]
-        ids = [c["id"] for c in chunks]
+    logger.info(f"Queued {file.filename} → doc_id={doc_id} job_id={job_id}")
+    return {"status": "queued", "doc_id": doc_id, "job_id": job_id}
 
-        embeddings = None
-        try:
-            embeddings = get_embeddings(texts)
-            if not embeddings or len(embeddings) != len(texts):
-                logger.warning("Embeddings length mismatch; disabling embeddings.")
-                embeddings = None
-        except Exception as ex:
-            logger.warning(f"Embedding generation failed: {ex}")
-            embeddings = None
 
-        metadatas = [
-            {"doc_filename": file.filename, "start": c["start"], "end": c["end"]}
-            for c in chunks
-        ]
+async def ingest_job(job_id, doc_id, save_path, filename, content_hash, pregenerate):
+    await run_ingest(job_id, doc_id, save_path, filename, content_hash)
+    if pregenerate:
+        await queue_pregeneration(doc_id)
 
-        doc_id = str(uuid.uuid4())
-        chroma_indexed = False
 
-        if embeddings:
-            add_chunks_to_chroma(doc_id, ids, texts, embeddings, metadatas)
-            chroma_indexed = True
+# ---------------------------
+# JOB STATUS
+# ---------------------------
+@app.get("/jobs/{id}")
+async def get_job_status(id: str):
+    job = await jobs.get_job(id)
+    if not job:
+        raise HTTPException(404, "Job not found")
+    return job
 
-        documents_collection.insert_one(
-            {
-                "doc_id": doc_id,
-                "filename": file.filename,
-                "pages_count": pages_count,
-                "chroma_indexed": chroma_indexed,
-                "chunks_text": chunks,
-                "llm_output": {},
-                "created_at": datetime.utcnow(),
-            }
-        )
 
-        logger.info(
-            f"Uploaded {file.filename} → doc_id={doc_id} "
-            f"(chunks={len(chunks)}, chroma_indexed={chroma_indexed})"
-        )
+# ---------------------------
+# METRICS (Prometheus text format)
+# ---------------------------
+@app.get("/metrics")
+async def get_metrics():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
 
-        return {"status": "ok", "doc_id": doc_id, "chroma_indexed": chroma_indexed}
 
-    finally:
-        try:
-            os.unlink(save_path)
-        except Exception:
-            pass
+# ---------------------------
+# HEALTH (liveness / readiness probes)
+# ---------------------------
+@app.get("/healthz")
+async def healthz():
+    # the event loop answers: the process is alive
+    return {"status": "ok", "pid": os.getpid()}
+
+
+async def _check(coro) -> str:
+    try:
+        await asyncio.wait_for(coro, READY_CHECK_TIMEOUT)
+        return "ok"
+    except Exception as ex:
+        return f"error: {ex!r}"
+
+
+@app.get("/readyz")
+async def readyz():
+    """Ready = warmed up and Mongo/Chroma answer. Gemini is reported, not required."""
+    if not _ready.is_set():
+        return JSONResponse({"ready": False, "checks": {"warm_up": "pending"}}, status_code=503)
+
+    mongo, chroma = await asyncio.gather(
+        _check(database.ping()), _check(rag.heartbeat())
+    )
+    checks = {"mongo": mongo, "chroma": chroma, "gemini_breaker": llm_channel.breaker.state}
+    ready = mongo == "ok" and chroma == "ok"
+    return JSONResponse({"ready": ready, "checks": checks}, status_code=200 if ready else 503)
+
+
+# ---------------------------
+# GEMINI CLIENT STATUS (rate limits, breaker, caches)
+# ---------------------------
+@app.get("/status/gemini")
+async def get_gemini_status():
+    return {
+        **gemini_status(),
+        "vector_cache": vector_cache.stats(),
+        "answer_cache": answer_cache.stats(),
+    }
+
+
+# ---------------------------
+# Stored artifacts (generate once, serve many)
+# ---------------------------
+def artifact_version(template: str, **params) -> str:
+    """
+    Hash of everything that shapes an artifact: model, prompt, parameters.
+    A stored artifact whose version differs is stale.
+    """
+    raw = json.dumps(
+        {"model": LLM_MODEL, "prompt": template, "params": params}, sort_keys=True
+    )
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()[:16]
+
+
+def artifact_meta(version: str, **params) -> dict:
+    return {
+        "version": version,
+        "params": params,
+        "generated_at": datetime.utcnow().isoformat(),
+    }
+
+
+def stored_artifact(llm: dict, kind: str, version: str, sub: str = None):
+    """
+    Return the stored artifact if it was generated with `version`, else None.
+    e.g. stored_artifact(llm, "mcq", v, "easy") → llm["mcq"]["easy"]
+    """
+    metas = llm.get("artifacts", {}).get(kind, {})
+    value = llm.get(kind)
+    if sub is not None:
+        metas = metas.get(sub, {})
+        value = (value or {}).get(sub)
+    if not value or metas.get("version") != version:
+        return None
+    return value
+
+
+def is_forced(payload: dict) -> bool:
+    return str(payload.get("force", "")).lower() in ("1", "true", "yes")
+
+
+DIFFICULTIES = ("easy", "medium", "hard")
+QUIZ_NUM_DEFAULT = 10
+
+
+def parse_difficulty(value) -> str:
+    # used inside Mongo field paths, so only known values are allowed
+    if value not in DIFFICULTIES:
+        raise HTTPException(400, f"difficulty must be one of {', '.join(DIFFICULTIES)}")
+    return value
+
+
+def flight_key(endpoint: str, doc_id: str, **params) -> str:
+    # pass force=: a forced request must never join (or, across workers,
+    # wait for and then just read) a normal one, which may serve the
+    # stored artifact; forced requests only share with each other
+    return f"{endpoint}:{doc_id}:{json.dumps(params, sort_keys=True)}"
+
+
+# fields every generation path needs; llm_output parts are added per call
+DOC_META_FIELDS = (
+    "doc_id",
+    "filename",
+    "pages_count",
+    "chunks_count",
+    "index_doc_id",
+    "chroma_indexed",
+)
+
+
+async def load_doc(doc_id: str, *fields) -> dict:
+    """
+    Projected document read: metadata plus the given (llm_output) fields.
+    Never pulls chunk texts or unrelated artifacts over the wire.
+    """
+    projection = {"_id": 0, **{f: 1 for f in DOC_META_FIELDS}, **{f: 1 for f in fields}}
+    with metrics.stage("mongo_read"):
+        doc = await documents_collection.find_one({"doc_id": doc_id}, projection)
+    if not doc:
+        raise HTTPException(404, "Document not found")
+    return doc
+
+
+def index_doc_id(doc: dict) -> str:
+    """Doc id the chunks are indexed under (differs for deduplicated uploads)."""
+    return doc.get("index_doc_id") or doc["doc_id"]
+
+
+async def doc_hits(doc: dict, query: str, n: int, **kwargs):
+    """Retrieve from the document's chunks (vector, lexical or hybrid)."""
+    # older records have no chroma_indexed field; they were all indexed
+    has_vectors = doc.get("chroma_indexed", True)
+    return await retrieve(index_doc_id(doc), query, n, has_vectors=has_vectors, **kwargs)
+
+
+async def coverage_hits(doc: dict, n: int):
+    """
+    The document's representative chunks (selection.py), no embedding
+    call. Documents ingested before selection existed get theirs
+    computed once from their Chroma vectors.
+    """
+    seqs = doc.get("representative_chunks")
+    if seqs is None and doc.get("chroma_indexed", True):
+        seqs = await representatives_from_index(index_doc_id(doc))
+        with metrics.stage("mongo_write"):
+            await documents_collection.update_one(
+                {"doc_id": doc["doc_id"]}, {"$set": {"representative_chunks": seqs}}
+            )
+    seqs = (seqs or [])[:n]
+    hits = await fetch_chunks(index_doc_id(doc), seqs)
+    if len(hits) < n:
+        # no vectors (or too few): spread over the document instead
+        hits += await spread_hits(index_doc_id(doc), n - len(hits), exclude=seqs)
+    return hits
+
+
+def build_context(hits, kind: str) -> str:
+    with metrics.stage("context_pack"):
+        context = pack_context(hits, CONTEXT_BUDGETS[kind])
+    metrics.observe_size("context", len(context))
+    return context
+
+
+def overview_version(template: str, doc: dict) -> str:
+    # map-reduce output differs from a single pass over representative chunks
+    if mapreduce.use_mapreduce(doc):
+        return artifact_version(template, mapreduce=mapreduce.MAP_VERSION)
+    return artifact_version(template)
+
+
+async def overview_context(doc: dict, kind: str, top_k: int):
+    """
+    (context, source texts for the fallback) for summary/notes: the
+    representative chunks, or for large documents every chunk condensed
+    map-reduce style (mapreduce.py).
+    """
+    if mapreduce.use_mapreduce(doc):
+        sections = await mapreduce.condense_document(index_doc_id(doc))
+        if sections:
+            context = mapreduce.format_sections(sections)
+            metrics.observe_size("context", len(context))
+            return context, [s["text"] for s in sections]
+
+    hits = await coverage_hits(doc, top_k)
+    if not hits:
+        raise HTTPException(400, f"No relevant chunks found for {kind}.")
+    return build_context(hits, kind), [h["document"] for h in hits]
 
 
 # ---------------------------
 # SUMMARY (POST → JSON body)
 # ---------------------------
 @app.post("/summary")
-def generate_summary(payload: dict):
+async def generate_summary(payload: dict):
     doc_id = payload.get("doc_id")
     if not doc_id:
         raise HTTPException(400, "doc_id missing")
 
-    doc = documents_collection.find_one({"doc_id": doc_id})
-    if not doc:
-        raise HTTPException(404, "Document not found")
+    force = is_forced(payload)
+    return await singleflight.do(
+        flight_key("summary", doc_id, force=force),
+        lambda: _generate_summary(doc_id, force),
+        after_wait=lambda: _generate_summary(doc_id, False),
+    )
+
+
+async def _generate_summary(doc_id: str, force: bool):
+    doc = await load_doc(
+        doc_id,
+        "llm_output.summary",
+        "llm_output.artifacts.summary",
+        "representative_chunks",
+    )
+
+    version = overview_version(SUMMARY_PROMPT, doc)
+    if not force:
+        stored = stored_artifact(doc.get("llm_output", {}), "summary", version)
+        if stored:
+            return {"summary": stored, "cached": True}
 
     pages_count = doc.get("pages_count", 0)
     # use more chunks for bigger docs
     top_k = 8 if pages_count <= 8 else 12
 
-    q_emb = get_embeddings([f"summary of {doc['filename']}"])[0]
-    hits = query_similar_chunks(q_emb, doc_id, n_results=top_k)
-    if not hits:
-        raise HTTPException(400, "No relevant chunks found for summary.")
-
-    chunks = [h["document"] for h in hits]
-    context = "\n---\n".join(chunks)
+    context, chunks = await overview_context(doc, "summary", top_k)
     prompt = SUMMARY_PROMPT.format(context=context, pages_count=pages_count)
 
-    raw = call_llm_once(prompt)
+    raw = await call_llm_once(prompt)
     parsed = extract_json_from_text(raw)
 
     if not parsed or "summary" not in parsed:
@@ -327,42 +608,57 @@ def generate_summary(payload: dict):
         fallback_text = " ".join(chunks[:3])
         parsed = {"summary": fallback_text}
 
-    llm_out = doc.get("llm_output", {})
-    llm_out["summary"] = parsed.get("summary", "")
+    summary = parsed.get("summary", "")
 
-    documents_collection.update_one(
-        {"doc_id": doc_id},
-        {"$set": {"llm_output": llm_out}},
-    )
-    return {"summary": llm_out["summary"]}
+    # targeted $set: never overwrite other artifacts or quiz progress
+    with metrics.stage("mongo_write"):
+        await documents_collection.update_one(
+            {"doc_id": doc_id},
+            {
+                "$set": {
+                    "llm_output.summary": summary,
+                    "llm_output.artifacts.summary": artifact_meta(version),
+                }
+            },
+        )
+    return {"summary": summary, "cached": False}
 
 
 # ---------------------------
 # NOTES (heading-wise, POST → JSON body)
 # ---------------------------
 @app.post("/notes")
-def generate_notes(payload: dict):
+async def generate_notes(payload: dict):
     doc_id = payload.get("doc_id")
     if not doc_id:
         raise HTTPException(400, "doc_id missing")
 
-    doc = documents_collection.find_one({"doc_id": doc_id})
-    if not doc:
-        raise HTTPException(404, "Document not found")
+    force = is_forced(payload)
+    return await singleflight.do(
+        flight_key("notes", doc_id, force=force),
+        lambda: _generate_notes(doc_id, force),
+        after_wait=lambda: _generate_notes(doc_id, False),
+    )
+
+
+async def _generate_notes(doc_id: str, force: bool):
+    doc = await load_doc(
+        doc_id, "llm_output.notes", "llm_output.artifacts.notes", "representative_chunks"
+    )
+
+    version = overview_version(NOTES_PROMPT, doc)
+    if not force:
+        stored = stored_artifact(doc.get("llm_output", {}), "notes", version)
+        if stored:
+            return {**stored, "cached": True}
 
     pages_count = doc.get("pages_count", 0)
     top_k = 10 if pages_count <= 10 else 14
 
-    q_emb = get_embeddings([f"detailed notes for {doc['filename']}"])[0]
-    hits = query_similar_chunks(q_emb, doc_id, n_results=top_k)
-    if not hits:
-        raise HTTPException(400, "No relevant chunks found for notes.")
-
-    chunks = [h["document"] for h in hits]
-    context = "\n---\n".join(chunks)
+    context, chunks = await overview_context(doc, "notes", top_k)
     prompt = NOTES_PROMPT.format(context=context, pages_count=pages_count)
 
-    raw = call_llm_once(prompt)
+    raw = await call_llm_once(prompt)
     parsed = extract_json_from_text(raw)
 
     if (
@@ -382,50 +678,67 @@ def generate_notes(payload: dict):
             "keywords": [],
         }
 
-    llm_out = doc.get("llm_output", {})
-    llm_out["notes"] = parsed
-    # keep keywords also at root if you want later usage
-    llm_out["keywords"] = parsed.get("keywords", [])
-
-    documents_collection.update_one(
-        {"doc_id": doc_id},
-        {"$set": {"llm_output": llm_out}},
-    )
-    return parsed
+    with metrics.stage("mongo_write"):
+        await documents_collection.update_one(
+            {"doc_id": doc_id},
+            {
+                "$set": {
+                    "llm_output.notes": parsed,
+                    # keep keywords also at root if you want later usage
+                    "llm_output.keywords": parsed.get("keywords", []),
+                    "llm_output.artifacts.notes": artifact_meta(version),
+                }
+            },
+        )
+    return {**parsed, "cached": False}
 
 
 # ---------------------------
 # MCQ GENERATION
 # ---------------------------
 @app.post("/mcq")
-def generate_mcq(payload: dict):
+async def generate_mcq(payload: dict):
     doc_id = payload.get("doc_id")
     if not doc_id:
         raise HTTPException(400, "doc_id missing")
 
-    difficulty = payload.get("difficulty", "easy")
-    num_raw = payload.get("num", 10)
+    difficulty = parse_difficulty(payload.get("difficulty", "easy"))
+    num_raw = payload.get("num", QUIZ_NUM_DEFAULT)
 
     try:
         num = int(num_raw)
     except Exception:
-        num = 10
+        num = QUIZ_NUM_DEFAULT
     num = max(5, min(20, num))  # clamp 5–20
 
-    doc = documents_collection.find_one({"doc_id": doc_id})
-    if not doc:
-        raise HTTPException(404, "Document not found")
+    force = is_forced(payload)
+    return await singleflight.do(
+        flight_key("mcq", doc_id, difficulty=difficulty, num=num, force=force),
+        lambda: _generate_mcq(doc_id, difficulty, num, force),
+        after_wait=lambda: _generate_mcq(doc_id, difficulty, num, False),
+    )
+
+
+async def _generate_mcq(doc_id: str, difficulty: str, num: int, force: bool):
+    doc = await load_doc(
+        doc_id, f"llm_output.mcq.{difficulty}", f"llm_output.artifacts.mcq.{difficulty}"
+    )
 
-    q_emb = get_embeddings([f"important topics from {doc['filename']}"])[0]
-    hits = query_similar_chunks(q_emb, doc_id, n_results=10)
+    version = artifact_version(MCQ_PROMPT, difficulty=difficulty, num=num)
+    if not force:
+        stored = stored_artifact(doc.get("llm_output", {}), "mcq", version, difficulty)
+        if stored:
+            return {"difficulty": difficulty, "count": len(stored), "cached": True}
+
+    hits = await doc_hits(doc, f"important topics from {doc['filename']}", 10, fill=True)
 
     if not hits:
         raise HTTPException(400, "No relevant chunks found for MCQ generation.")
 
-    context = "\n---\n".join([h["document"] for h in hits])
+    context = build_context(hits, "mcq")
     prompt = MCQ_PROMPT.format(context=context, difficulty=difficulty, num=num)
 
-    raw = call_llm_once(prompt)
+    raw = await call_llm_once(prompt)
     parsed = extract_json_from_text(raw)
     if not parsed or not isinstance(parsed, list):
         parsed = []
@@ -446,23 +759,31 @@ def generate_mcq(payload: dict):
         }
         normalized.append(nq)
 
-    llm = doc.get("llm_output", {})
-    if "mcq" not in llm:
-        llm["mcq"] = {}
-    llm["mcq"][difficulty] = normalized
-
-    documents_collection.update_one(
-        {"doc_id": doc_id},
-        {"$set": {"llm_output": llm}},
-    )
-    return {"difficulty": difficulty, "count": len(normalized)}
+    with metrics.stage("mongo_write"):
+        await documents_collection.update_one(
+            {"doc_id": doc_id},
+            {
+                "$set": {
+                    f"llm_output.mcq.{difficulty}": normalized,
+                    f"llm_output.artifacts.mcq.{difficulty}": artifact_meta(
+                        version, difficulty=difficulty, num=num
+                    ),
+                }
+            },
+        )
+    return {"difficulty": difficulty, "count": len(normalized), "cached": False}
 
 
 # ---------------------------
-# MCQ PROGRESS SAVE
+# Progress save helper (MCQ + fillups)
 # ---------------------------
-@app.post("/mcq/save-progress")
-def save_mcq_progress(payload: dict):
+async def save_progress(payload: dict, kind: str, normalize, not_found: str):
+    """
+    Record one answer batch as ONE atomic update.
+    Only the answered questions are touched (array filters on id), so the
+    write size is independent of the stored artifacts, and concurrent
+    batches or generations are never overwritten.
+    """
     doc_id = payload.get("doc_id")
     difficulty = payload.get("difficulty")
     batch_ids = payload.get("batch_ids", [])
@@ -470,79 +791,112 @@ def save_mcq_progress(payload: dict):
 
     if not doc_id or not difficulty:
         raise HTTPException(400, "doc_id and difficulty are required.")
+    difficulty = parse_difficulty(difficulty)
 
-    doc = documents_collection.find_one({"doc_id": doc_id})
+    # only ids + answers are needed to grade
+    path = f"llm_output.{kind}.{difficulty}"
+    with metrics.stage("mongo_read"):
+        doc = await documents_collection.find_one(
+            {"doc_id": doc_id}, {"_id": 0, f"{path}.id": 1, f"{path}.answer": 1}
+        )
     if not doc:
         raise HTTPException(404, "Document not found")
 
-    llm = doc.get("llm_output", {})
-    mcq_data = llm.get("mcq", {})
-    questions = mcq_data.get(difficulty, [])
-
+    questions = doc.get("llm_output", {}).get(kind, {}).get(difficulty, [])
     if not questions:
-        raise HTTPException(400, "No MCQs found for this difficulty.")
+        raise HTTPException(400, not_found)
 
     batch_set = set(batch_ids or [])
     ans_map = answers or {}
 
+    update, array_filters, seen = {}, [], set()
     for q in questions:
         qid = q.get("id")
-        if not qid or qid not in batch_set:
+        # one filter per id (it matches every question with that id)
+        if not qid or qid not in batch_set or qid in seen:
             continue
+        seen.add(qid)
 
-        user = (ans_map.get(qid) or "").strip()
-        correct = str(q.get("answer", "")).strip()
+        user = normalize(ans_map.get(qid) or "")
+        correct = normalize(str(q.get("answer", "")))
 
-        if not user:
-            q["user_answer"] = ""
-            q["result"] = "not answered"
-        else:
-            q["user_answer"] = user
-            q["result"] = "correct" if user == correct else "wrong"
+        f = f"q{len(array_filters)}"
+        update[f"{path}.$[{f}].user_answer"] = user
+        update[f"{path}.$[{f}].result"] = (
+            "not answered" if not user else "correct" if user == correct else "wrong"
+        )
+        # matching the answer too ignores a batch graded against a set
+        # that was regenerated in the meantime
+        array_filters.append({f"{f}.id": qid, f"{f}.answer": q.get("answer", "")})
+
+    update[f"llm_output.{kind}_last_updated"] = datetime.utcnow().isoformat()
+    with metrics.stage("mongo_write"):
+        await documents_collection.update_one(
+            {"doc_id": doc_id},
+            {"$set": update},
+            array_filters=array_filters or None,
+        )
+    return {"status": "ok"}
 
-    mcq_data[difficulty] = questions
-    llm["mcq"] = mcq_data
-    llm.setdefault("mcq_last_updated", datetime.utcnow().isoformat())
 
-    documents_collection.update_one(
-        {"doc_id": doc_id},
-        {"$set": {"llm_output": llm}},
+# ---------------------------
+# MCQ PROGRESS SAVE
+# ---------------------------
+@app.post("/mcq/save-progress")
+async def save_mcq_progress(payload: dict):
+    return await save_progress(
+        payload, "mcq", lambda v: v.strip(), "No MCQs found for this difficulty."
     )
-    return {"status": "ok"}
 
 
 # ---------------------------
 # FILLUPS GENERATION
 # ---------------------------
 @app.post("/fillups")
-def generate_fillups(payload: dict):
+async def generate_fillups(payload: dict):
     doc_id = payload.get("doc_id")
     if not doc_id:
         raise HTTPException(400, "doc_id missing")
 
-    difficulty = payload.get("difficulty", "easy")
-    num_raw = payload.get("num", 10)
+    difficulty = parse_difficulty(payload.get("difficulty", "easy"))
+    num_raw = payload.get("num", QUIZ_NUM_DEFAULT)
 
     try:
         num = int(num_raw)
     except Exception:
-        num = 10
+        num = QUIZ_NUM_DEFAULT
     num = max(5, min(20, num))  # clamp 5–20
 
-    doc = documents_collection.find_one({"doc_id": doc_id})
-    if not doc:
-        raise HTTPException(404, "Document not found")
+    force = is_forced(payload)
+    return await singleflight.do(
+        flight_key("fillups", doc_id, difficulty=difficulty, num=num, force=force),
+        lambda: _generate_fillups(doc_id, difficulty, num, force),
+        after_wait=lambda: _generate_fillups(doc_id, difficulty, num, False),
+    )
+
 
-    q_emb = get_embeddings([f"key terms from {doc['filename']}"])[0]
-    hits = query_similar_chunks(q_emb, doc_id, n_results=10)
+async def _generate_fillups(doc_id: str, difficulty: str, num: int, force: bool):
+    doc = await load_doc(
+        doc_id,
+        f"llm_output.fillups.{difficulty}",
+        f"llm_output.artifacts.fillups.{difficulty}",
+    )
+
+    version = artifact_version(FILLUPS_PROMPT, difficulty=difficulty, num=num)
+    if not force:
+        stored = stored_artifact(doc.get("llm_output", {}), "fillups", version, difficulty)
+        if stored:
+            return {"difficulty": difficulty, "count": len(stored), "cached": True}
+
+    hits = await doc_hits(doc, f"key terms from {doc['filename']}", 10, fill=True)
 
     if not hits:
         raise HTTPException(400, "No relevant chunks found for fillups generation.")
 
-    context = "\n---\n".join([h["document"] for h in hits])
+    context = build_context(hits, "fillups")
     prompt = FILLUPS_PROMPT.format(context=context, difficulty=difficulty, num=num)
 
-    raw = call_llm_once(prompt)
+    raw = await call_llm_once(prompt)
     parsed = extract_json_from_text(raw)
     if not parsed or not isinstance(parsed, list):
         parsed = []
@@ -560,128 +914,303 @@ def generate_fillups(payload: dict):
         }
         normalized.append(nq)
 
-    llm = doc.get("llm_output", {})
-    if "fillups" not in llm:
-        llm["fillups"] = {}
-    llm["fillups"][difficulty] = normalized
-
-    documents_collection.update_one(
-        {"doc_id": doc_id},
-        {"$set": {"llm_output": llm}},
-    )
-    return {"difficulty": difficulty, "count": len(normalized)}
+    with metrics.stage("mongo_write"):
+        await documents_collection.update_one(
+            {"doc_id": doc_id},
+            {
+                "$set": {
+                    f"llm_output.fillups.{difficulty}": normalized,
+                    f"llm_output.artifacts.fillups.{difficulty}": artifact_meta(
+                        version, difficulty=difficulty, num=num
+                    ),
+                }
+            },
+        )
+    return {"difficulty": difficulty, "count": len(normalized), "cached": False}
 
 
 # ---------------------------
 # FILLUPS PROGRESS SAVE
 # ---------------------------
 @app.post("/fillups/save-progress")
-def save_fillups_progress(payload: dict):
+async def save_fillups_progress(payload: dict):
+    return await save_progress(
+        payload,
+        "fillups",
+        lambda v: v.strip().lower(),
+        "No fillups found for this difficulty.",
+    )
+
+
+# ---------------------------
+# CHAT (RAG → LLM)
+# ---------------------------
+NO_CONTEXT_ANSWER = "I could not find relevant information in the document."
+
+
+async def build_chat_prompt(payload: dict):
+    """
+    Validate the chat payload and retrieve context.
+    Returns (prompt, answer cache key); the prompt is None when nothing
+    relevant was found.
+    """
     doc_id = payload.get("doc_id")
-    difficulty = payload.get("difficulty")
-    batch_ids = payload.get("batch_ids", [])
-    answers = payload.get("answers", {})
+    question = payload.get("question")
 
-    if not doc_id or not difficulty:
-        raise HTTPException(400, "doc_id and difficulty are required.")
+    if not doc_id or not question:
+        raise HTTPException(400, "doc_id and question are required.")
 
-    doc = documents_collection.find_one({"doc_id": doc_id})
-    if not doc:
-        raise HTTPException(404, "Document not found")
+    # "fast" (or a keyword-style question): BM25 only, no embedding round trip
+    mode = payload.get("mode")
+    auto_fast = mode is None and is_keyword_query(question)
+    if mode == "fast" or auto_fast:
+        mode = "lexical"
+    elif mode not in MODES:
+        mode = None
 
-    llm = doc.get("llm_output", {})
-    fill_data = llm.get("fillups", {})
-    questions = fill_data.get(difficulty, [])
+    doc = await load_doc(doc_id)
+    hits = await doc_hits(doc, question, 4, mode=mode)
+    if not hits and auto_fast:
+        mode = None
+        hits = await doc_hits(doc, question, 4)
 
-    if not questions:
-        raise HTTPException(400, "No fillups found for this difficulty.")
+    if not hits:
+        return None, None
 
-    batch_set = set(batch_ids or [])
-    ans_map = answers or {}
+    key = None
+    if answer_cache.enabled():
+        vector = None
+        if mode != "lexical" and doc.get("chroma_indexed", True):
+            # retrieval just embedded the question: this is a cache hit
+            try:
+                vector = await embed_query(question)
+            except Exception:
+                pass
+        key = answer_cache.ChatKey.build(index_doc_id(doc), question, hits, vector)
 
-    for q in questions:
-        qid = q.get("id")
-        if not qid or qid not in batch_set:
-            continue
+    context = build_context(hits, "chat")
+    return CHAT_PROMPT.format(context=context, question=question), key
 
-        user = (ans_map.get(qid) or "").strip().lower()
-        correct = str(q.get("answer", "")).strip().lower()
 
-        if not user:
-            q["user_answer"] = ""
-            q["result"] = "not answered"
-        else:
-            q["user_answer"] = user
-            q["result"] = "correct" if user == correct else "wrong"
+@app.post("/chat")
+async def chat(payload: dict):
+    prompt, key = await build_chat_prompt(payload)
+    if prompt is None:
+        return {"answer": NO_CONTEXT_ANSWER}
 
-    fill_data[difficulty] = questions
-    llm["fillups"] = fill_data
-    llm.setdefault("fillups_last_updated", datetime.utcnow().isoformat())
+    if key is not None:
+        answer = answer_cache.lookup(key)
+        if answer is not None:
+            return {"answer": answer, "cached": True}
 
-    documents_collection.update_one(
-        {"doc_id": doc_id},
-        {"$set": {"llm_output": llm}},
-    )
-    return {"status": "ok"}
+    answer = await call_llm_once(prompt)
+    if key is not None:
+        answer_cache.store(key, answer)
+    return {"answer": answer, "cached": False}
+
+
+def sse(data: dict, event: str = None) -> str:
+    head = f"event: {event}\n" if event else ""
+    return f"{head}data: {json.dumps(data)}\n\n"
 
 
 # ---------------------------
-# CHAT (RAG → LLM)
+# CHAT (streaming, Server-Sent Events)
 # ---------------------------
-@app.post("/chat")
-def chat(payload: dict):
-    doc_id = payload.get("doc_id")
-    question = payload.get("question")
+@app.post("/chat/stream")
+async def chat_stream(payload: dict, request: Request):
+    """
+    Same as /chat, but the answer is sent as SSE events while Gemini
+    generates it: `data: {"delta": "..."}` per piece, then `event: done`.
+    Generation stops when the client disconnects.
+    """
+    prompt, key = await build_chat_prompt(payload)
+    cached = answer_cache.lookup(key) if key is not None else None
+
+    async def events():
+        if prompt is None or cached is not None:
+            yield sse({"delta": NO_CONTEXT_ANSWER if prompt is None else cached})
+            yield sse({}, event="done")
+            return
+
+        pieces = stream_llm(prompt)
+        answer = []
+        try:
+            async for piece in pieces:
+                if await request.is_disconnected():
+                    logger.info("Chat client disconnected; stopping generation.")
+                    return
+                answer.append(piece)
+                yield sse({"delta": piece})
+            # only complete answers are cached
+            if key is not None:
+                answer_cache.store(key, "".join(answer))
+            yield sse({}, event="done")
+        except Exception as ex:
+            logger.warning(f"Chat stream failed: {ex}")
+            yield sse({"error": "Failed to generate answer."}, event="error")
+        finally:
+            await pieces.aclose()
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
-    if not doc_id or not question:
-        raise HTTPException(400, "doc_id and question are required.")
 
-    doc = documents_collection.find_one({"doc_id": doc_id})
-    if not doc:
-        raise HTTPException(404, "Document not found")
+# ---------------------------
+# PRE-GENERATION (background, after ingest)
+# ---------------------------
+# default for uploads without ?pregenerate=
+PREGENERATE = os.getenv("PREGENERATE", "0").lower() in ("1", "true", "yes")
+# a pre-generation call only starts while fewer LLM calls than this are in flight
+PREGEN_MAX_IN_FLIGHT = int(
+    os.getenv("PREGEN_MAX_IN_FLIGHT", str(max(1, LLM_MAX_CONCURRENCY // 4)))
+)
+PREGEN_IDLE_POLL = 0.5
 
-    q_emb = get_embeddings([question])[0]
-    hits = query_similar_chunks(q_emb, doc_id, n_results=4)
+# in the order a student usually opens the tabs
+PREGEN_ARTIFACTS = ("summary", "notes") + tuple(
+    f"{kind}.{difficulty}" for difficulty in DIFFICULTIES for kind in ("mcq", "fillups")
+)
 
-    if not hits:
-        return {"answer": "I could not find relevant information in the document."}
 
-    context = "\n---\n".join(h["document"] for h in hits)
-    prompt = CHAT_PROMPT.format(context=context, question=question)
+async def _set_pregen(doc_id: str, fields: dict):
+    await documents_collection.update_one(
+        {"doc_id": doc_id}, {"$set": {f"pregen.{k}": v for k, v in fields.items()}}
+    )
 
-    return {"answer": call_llm_once(prompt)}
+
+async def queue_pregeneration(doc_id: str):
+    await _set_pregen(
+        doc_id,
+        {"status": "queued", **{f"artifacts.{name}": "pending" for name in PREGEN_ARTIFACTS}},
+    )
+    jobs.submit_background(pregenerate_artifacts, doc_id)
+
+
+def _pregen_call(name: str, doc_id: str):
+    # the endpoint functions: same single-flight keys as a student's click
+    kind, _, difficulty = name.partition(".")
+    payload = {"doc_id": doc_id}
+    if difficulty:
+        payload["difficulty"] = difficulty
+    generate = {
+        "summary": generate_summary,
+        "notes": generate_notes,
+        "mcq": generate_mcq,
+        "fillups": generate_fillups,
+    }[kind]
+    return generate(payload)
+
+
+async def pregenerate_artifacts(doc_id: str):
+    """
+    Generate every study artifact of a document, one at a time, each
+    only when the LLM channel has spare capacity. Each one lands in
+    llm_output as it completes; pregen.artifacts tracks progress.
+    """
+    token = metrics.current_endpoint.set("pregenerate")
+    try:
+        await _set_pregen(doc_id, {"status": "running"})
+        failed = 0
+        for name in PREGEN_ARTIFACTS:
+            while not llm_channel.has_spare_capacity(PREGEN_MAX_IN_FLIGHT):
+                await asyncio.sleep(PREGEN_IDLE_POLL)
+            await _set_pregen(doc_id, {f"artifacts.{name}": "generating"})
+            try:
+                with metrics.stage(f"pregen_{name.split('.')[0]}"):
+                    await _pregen_call(name, doc_id)
+                state = "ready"
+            except Exception as ex:
+                logger.warning(f"Pre-generation of {name} for {doc_id} failed: {ex!r}")
+                state = "failed"
+                failed += 1
+            await _set_pregen(doc_id, {f"artifacts.{name}": state})
+        await _set_pregen(
+            doc_id,
+            {"status": "failed" if failed else "done", "finished_at": datetime.utcnow()},
+        )
+        logger.info(f"Pre-generated {len(PREGEN_ARTIFACTS) - failed} artifacts for {doc_id}")
+    finally:
+        metrics.current_endpoint.reset(token)
 
 
 # ---------------------------
 # GETTERS
 # ---------------------------
+@app.get("/docs/{id}/status")
+async def get_doc_status(id: str):
+    """
+    Which artifacts are ready to serve (stored with the current version),
+    and otherwise how far pre-generation got with them.
+    """
+    doc = await load_doc(id, "llm_output.artifacts", "pregen")
+    metas = doc.get("llm_output", {}).get("artifacts", {})
+    pregen = doc.get("pregen") or {}
+    progress = pregen.get("artifacts", {})
+
+    def state(kind: str, version: str, difficulty: str = None) -> str:
+        meta = metas.get(kind, {})
+        pending = progress.get(kind, {})
+        if difficulty:
+            meta = meta.get(difficulty, {})
+            pending = pending.get(difficulty)
+        if meta.get("version") == version:
+            return "ready"
+        return pending if isinstance(pending, str) else "missing"
+
+    artifacts = {
+        "summary": state("summary", overview_version(SUMMARY_PROMPT, doc)),
+        "notes": state("notes", overview_version(NOTES_PROMPT, doc)),
+    }
+    for kind, template in (("mcq", MCQ_PROMPT), ("fillups", FILLUPS_PROMPT)):
+        artifacts[kind] = {
+            d: state(
+                kind, artifact_version(template, difficulty=d, num=QUIZ_NUM_DEFAULT), d
+            )
+            for d in DIFFICULTIES
+        }
+
+    states = [artifacts["summary"], artifacts["notes"]] + [
+        s for kind in ("mcq", "fillups") for s in artifacts[kind].values()
+    ]
+    return {
+        "doc_id": id,
+        "ready": all(s == "ready" for s in states),
+        "pregeneration": pregen.get("status"),
+        "artifacts": artifacts,
+    }
+
+
 @app.get("/docs/{id}/summary")
-def get_summary(id: str):
-    d = documents_collection.find_one(
+async def get_summary(id: str):
+    d = await documents_collection.find_one(
         {"doc_id": id}, {"_id": 0, "llm_output.summary": 1}
     )
     return {"summary": d.get("llm_output", {}).get("summary", "") if d else ""}
 
 
 @app.get("/docs/{id}/notes")
-def get_notes(id: str):
-    d = documents_collection.find_one(
+async def get_notes(id: str):
+    d = await documents_collection.find_one(
         {"doc_id": id}, {"_id": 0, "llm_output.notes": 1}
     )
     return {"notes": d.get("llm_output", {}).get("notes", {}) if d else {}}
 
 
 @app.get("/docs/{id}/mcq")
-def get_mcq(id: str):
-    d = documents_collection.find_one(
+async def get_mcq(id: str):
+    d = await documents_collection.find_one(
         {"doc_id": id}, {"_id": 0, "llm_output.mcq": 1}
     )
     return d.get("llm_output", {}).get("mcq", {}) if d else {}
 
 
 @app.get("/docs/{id}/fillups")
-def get_fillups(id: str):
-    d = documents_collection.find_one(
+async def get_fillups(id: str):
+    d = await documents_collection.find_one(
         {"doc_id": id}, {"_id": 0, "llm_output.fillups": 1}
     )
     return d.get("llm_output", {}).get("fillups", {}) if d else {}
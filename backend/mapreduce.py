@@ -0,0 +1,182 @@
+# mapreduce.py
+"""
+Map-reduce context for summary/notes of large documents.
+
+The document's chunks are split into consecutive groups; each group is
+condensed by its own LLM call (map), run in parallel under a
+concurrency cap. The condensed sections then go to the normal summary
+or notes prompt as its context (reduce), so the whole document is seen
+and wall-clock time is about one map call plus one reduce call.
+
+Map results are stored in the `partials` collection keyed by a hash of
+the map prompt and the group's text: regenerating, or generating notes
+after a summary, reuses them.
+"""
+import os
+import asyncio
+import hashlib
+import logging
+from datetime import datetime
+from typing import List
+
+import metrics
+from chunker import estimate_tokens
+from context import merge_hits, SEPARATOR
+from database import chunks_collection, partials_collection
+from gemini_client import call_llm_once, LLM_MODEL
+
+# documents with at least this many chunks are generated map-reduce
+MAPREDUCE_MIN_CHUNKS = int(os.getenv("MAPREDUCE_MIN_CHUNKS", "40"))
+# document text per map call, in (estimated) tokens
+MAP_GROUP_TOKENS = int(os.getenv("MAP_GROUP_TOKENS", "4000"))
+# map calls in flight per document
+MAP_CONCURRENCY = int(os.getenv("MAP_CONCURRENCY", "8"))
+# word limit per condensed section
+MAP_MAX_WORDS = int(os.getenv("MAP_MAX_WORDS", "150"))
+# condensed sections above this size are condensed again before the reduce
+REDUCE_CONTEXT_TOKENS = int(os.getenv("REDUCE_CONTEXT_TOKENS", "10000"))
+MAX_LEVELS = 3
+
+logger = logging.getLogger("backend.mapreduce")
+
+MAP_PROMPT = """
+Condense this part of a document for a student. Return plain text, no extra commentary.
+
+Rules:
+- Use ONLY the text in "Section" (do NOT add external facts).
+- First line: a short title for the section.
+- Then one bullet per important idea: definitions, steps, formulas, key facts.
+- Keep names, numbers and formulas exactly as written.
+- At most {max_words} words.
+
+Section (pages {pages}):
+{text}
+"""
+
+# part of every partial's key and of the artifact version of map-reduce outputs
+MAP_VERSION = hashlib.sha256(
+    f"{LLM_MODEL}|{MAP_PROMPT}|{MAP_GROUP_TOKENS}|{MAP_MAX_WORDS}".encode("utf-8")
+).hexdigest()[:16]
+
+
+def use_mapreduce(doc: dict) -> bool:
+    return (doc.get("chunks_count") or 0) >= MAPREDUCE_MIN_CHUNKS
+
+
+def _pages(parts: List[dict]) -> str:
+    start, end = parts[0].get("page_start"), parts[-1].get("page_end")
+    if start is None or end is None:
+        return "?"
+    return str(start) if start == end else f"{start}-{end}"
+
+
+def _join(parts: List[dict]) -> str:
+    if "metadata" in parts[0]:
+        # raw chunks: drop the overlap between neighbours
+        return SEPARATOR.join(s["text"] for s in merge_hits(parts))
+    return SEPARATOR.join(p["text"] for p in parts)
+
+
+def group_sections(sections: List[dict], max_tokens: int) -> List[dict]:
+    """Join consecutive sections (chunks or condensed groups) into ~max_tokens groups."""
+    groups, cur, used = [], [], 0
+
+    def close():
+        groups.append({
+            "pages": _pages(cur),
+            "page_start": cur[0].get("page_start"),
+            "page_end": cur[-1].get("page_end"),
+            "text": _join(cur),
+        })
+
+    for s in sections:
+        cost = estimate_tokens(s["text"])
+        if cur and used + cost > max_tokens:
+            close()
+            cur, used = [], 0
+        cur.append(s)
+        used += cost
+    if cur:
+        close()
+    return groups
+
+
+async def load_chunks(doc_id: str) -> List[dict]:
+    """All chunks of the document in order, shaped for merge_hits."""
+    chunks = []
+    with metrics.stage("mongo_read"):
+        cursor = chunks_collection.find(
+            {"doc_id": doc_id},
+            {"_id": 0, "chunk_id": 1, "text": 1, "start": 1, "end": 1,
+             "page_start": 1, "page_end": 1},
+            sort=[("seq", 1)],
+        )
+        async for rec in cursor:
+            chunks.append({
+                "text": rec["text"],
+                "document": rec["text"],
+                "metadata": {"doc_id": doc_id, "start": rec.get("start"), "end": rec.get("end")},
+                "page_start": rec.get("page_start"),
+                "page_end": rec.get("page_end"),
+            })
+    return chunks
+
+
+def partial_key(text: str) -> str:
+    return hashlib.sha256(f"{MAP_VERSION}|{text}".encode("utf-8")).hexdigest()
+
+
+async def _cached(keys: List[str]) -> dict:
+    with metrics.stage("mongo_read"):
+        cursor = partials_collection.find({"_id": {"$in": keys}}, {"text": 1})
+        return {p["_id"]: p["text"] async for p in cursor}
+
+
+async def map_groups(groups: List[dict]) -> List[dict]:
+    """Condense every group (cached ones are not sent again), in order."""
+    keys = [partial_key(g["text"]) for g in groups]
+    done = await _cached(keys)
+    slots = asyncio.Semaphore(MAP_CONCURRENCY)
+
+    async def condense(group: dict, key: str) -> str:
+        async with slots:
+            prompt = MAP_PROMPT.format(
+                max_words=MAP_MAX_WORDS, pages=group["pages"], text=group["text"]
+            )
+            text = (await call_llm_once(prompt)).strip()
+        # stored as soon as it exists, so a failed run still keeps its progress
+        with metrics.stage("mongo_write"):
+            await partials_collection.update_one(
+                {"_id": key},
+                {"$set": {"text": text, "created_at": datetime.utcnow()}},
+                upsert=True,
+            )
+        return text
+
+    missing = [(g, k) for g, k in zip(groups, keys) if k not in done]
+    logger.info(f"Map step: {len(groups)} groups, {len(missing)} to condense")
+    texts = await asyncio.gather(*[condense(g, k) for g, k in missing])
+    done.update((k, t) for (_, k), t in zip(missing, texts))
+    return [{**g, "text": done[k]} for g, k in zip(groups, keys)]
+
+
+async def condense_document(doc_id: str) -> List[dict]:
+    """
+    Condensed sections of the whole document, in order, small enough for
+    one reduce prompt (large documents are condensed more than once).
+    """
+    sections = await load_chunks(doc_id)
+    if not sections:
+        return []
+    with metrics.stage("mapreduce_map"):
+        for _ in range(MAX_LEVELS):
+            sections = await map_groups(group_sections(sections, MAP_GROUP_TOKENS))
+            total = sum(estimate_tokens(s["text"]) for s in sections)
+            if total <= REDUCE_CONTEXT_TOKENS or len(sections) == 1:
+                break
+    return sections
+
+
+def format_sections(sections: List[dict]) -> str:
+    """Reduce-prompt context: one labelled block per condensed section."""
+    return SEPARATOR.join(f"Pages {s['pages']}:\n{s['text']}" for s in sections)
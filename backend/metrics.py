@@ -0,0 +1,224 @@
+# metrics.py
+"""
+Small in-process metrics registry, exported in the Prometheus text
+format at GET /metrics. Stage timings are labelled with the endpoint
+that caused them (set per request by MetricsMiddleware, or explicitly
+for background work such as ingestion jobs).
+"""
+import time
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from starlette.routing import Match
+
+current_endpoint: ContextVar[str] = ContextVar("current_endpoint", default="none")
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+SIZE_BUCKETS = (64, 256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values, extra=()) -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)] + list(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(labels.get(n, "") for n in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} counter"
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            yield f"{self.name}{_labels(self.labelnames, key)} {value}"
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        # labels → [per-bucket counts (+Inf last), sum, count]
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(labels.get(n, "") for n in self.labelnames)
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][i] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} histogram"
+        with self._lock:
+            items = sorted((k, (list(s[0]), s[1], s[2])) for k, s in self._series.items())
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, n in zip(self.buckets + ("+Inf",), counts):
+                cumulative += n
+                le = f'le="{bound}"'
+                yield f"{self.name}_bucket{_labels(self.labelnames, key, (le,))} {cumulative}"
+            yield f"{self.name}_sum{_labels(self.labelnames, key)} {total}"
+            yield f"{self.name}_count{_labels(self.labelnames, key)} {count}"
+
+
+REQUEST_SECONDS = Histogram(
+    "http_request_duration_seconds",
+    "Request latency (until the response body is sent).",
+    ("endpoint", "method", "status"),
+)
+STAGE_SECONDS = Histogram(
+    "stage_duration_seconds",
+    "Time spent per processing stage.",
+    ("endpoint", "stage"),
+)
+PAYLOAD_BYTES = Histogram(
+    "payload_size_bytes",
+    "Sizes of request/response bodies, uploaded PDFs, prompt contexts and LLM responses.",
+    ("endpoint", "kind"),
+    SIZE_BUCKETS,
+)
+PROMPT_TOKENS = Histogram(
+    "llm_prompt_tokens",
+    "Estimated tokens per LLM prompt.",
+    ("endpoint",),
+    SIZE_BUCKETS,
+)
+EMBED_BATCH_TEXTS = Histogram(
+    "embed_batch_texts",
+    "Texts per embedding provider call.",
+    ("endpoint",),
+    (1, 2, 5, 10, 25, 50, 100, 250),
+)
+GEMINI_RETRIES = Counter(
+    "gemini_retries_total", "Retried Gemini calls.", ("channel", "endpoint")
+)
+GEMINI_ERRORS = Counter(
+    "gemini_errors_total",
+    "Failed Gemini calls (retryable = provider busy/down).",
+    ("channel", "kind"),
+)
+
+VECTOR_CACHE_LOOKUPS = Counter(
+    "vector_cache_lookups_total",
+    "Per-document vector matrix lookups (hit = already in memory).",
+    ("result",),
+)
+ANSWER_CACHE_LOOKUPS = Counter(
+    "answer_cache_lookups_total",
+    "Chat answer cache lookups (hit = answered without an LLM call).",
+    ("result",),
+)
+
+REGISTRY = [
+    REQUEST_SECONDS,
+    STAGE_SECONDS,
+    PAYLOAD_BYTES,
+    PROMPT_TOKENS,
+    EMBED_BATCH_TEXTS,
+    GEMINI_RETRIES,
+    GEMINI_ERRORS,
+    VECTOR_CACHE_LOOKUPS,
+    ANSWER_CACHE_LOOKUPS,
+]
+
+
+def observe_stage(name: str, seconds: float, endpoint: str = None):
+    STAGE_SECONDS.observe(seconds, endpoint=endpoint or current_endpoint.get(), stage=name)
+
+
+@contextmanager
+def stage(name: str):
+    """Time the enclosed block as stage `name` of the current endpoint."""
+    t = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(name, time.perf_counter() - t)
+
+
+def observe_size(kind: str, size: int):
+    PAYLOAD_BYTES.observe(size, endpoint=current_endpoint.get(), kind=kind)
+
+
+def render() -> str:
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# ---------------------------
+# ASGI middleware
+# ---------------------------
+def _route_template(scope) -> str:
+    # label by route ("/docs/{id}/mcq"), never by raw path (ids → cardinality)
+    app = scope.get("app")
+    for route in getattr(app, "routes", ()):
+        match, _ = route.matches(scope)
+        if match == Match.FULL:
+            return route.path
+    return "unmatched"
+
+
+class MetricsMiddleware:
+    """Times every HTTP request and sets current_endpoint for its stages."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        endpoint = _route_template(scope)
+        token = current_endpoint.set(endpoint)
+        status, sent = 500, 0
+        t = time.perf_counter()
+
+        async def send_wrapper(message):
+            nonlocal status, sent
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body":
+                sent += len(message.get("body", b""))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            REQUEST_SECONDS.observe(
+                time.perf_counter() - t,
+                endpoint=endpoint,
+                method=scope["method"],
+                status=status,
+            )
+            length = dict(scope.get("headers") or ()).get(b"content-length")
+            if length and length.isdigit():
+                PAYLOAD_BYTES.observe(int(length), endpoint=endpoint, kind="request")
+            PAYLOAD_BYTES.observe(sent, endpoint=endpoint, kind="response")
+            current_endpoint.reset(token)
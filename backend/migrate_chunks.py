@@ -0,0 +1,56 @@
+# migrate_chunks.py
+"""
+One-off migration: move `chunks_text` arrays out of `documents` records
+into the `chunks` collection, then drop them from the documents.
+Safe to re-run; already-migrated records are skipped.
+
+    python migrate_chunks.py
+"""
+import asyncio
+import logging
+
+from pymongo import ReplaceOne
+
+from database import documents_collection, chunks_collection, chunk_record, ensure_indexes
+from lexical import analyze
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger("migrate_chunks")
+
+
+async def migrate_embedded_chunks() -> int:
+    await ensure_indexes()
+    migrated = 0
+    cursor = documents_collection.find(
+        {"chunks_text": {"$exists": True}},
+        {"_id": 0, "doc_id": 1, "index_doc_id": 1, "chunks_text": 1},
+    )
+    async for doc in cursor:
+        index_doc_id = doc.get("index_doc_id") or doc["doc_id"]
+        chunks = doc.get("chunks_text") or []
+        if chunks:
+            for c in chunks:
+                c["terms"], c["length"] = analyze(c.get("text") or "")
+            await chunks_collection.bulk_write(
+                [
+                    ReplaceOne(
+                        {"doc_id": index_doc_id, "seq": int(c["id"])},
+                        chunk_record(index_doc_id, c),
+                        upsert=True,
+                    )
+                    for c in chunks
+                ],
+                ordered=False,
+            )
+        await documents_collection.update_one(
+            {"doc_id": doc["doc_id"]},
+            {"$set": {"chunks_count": len(chunks)}, "$unset": {"chunks_text": ""}},
+        )
+        migrated += 1
+        logger.info(f"Migrated {len(chunks)} chunks of doc_id={doc['doc_id']}")
+    return migrated
+
+
+if __name__ == "__main__":
+    n = asyncio.run(migrate_embedded_chunks())
+    logger.info(f"Done: {n} documents migrated.")
@@ -0,0 +1,82 @@
+# migrate_vectors.py
+"""
+One-off migration: move each document's vectors out of the global
+Chroma collection into its own `doc_<doc_id>` collection (see rag.py).
+Safe to re-run, also after an interrupted run: a document is queried
+from the global collection until its own collection exists, and its
+global entries are deleted only after the copy. Running it while the
+API is serving needs a Chroma server (CHROMA_HOST): two processes must
+not share a local Chroma directory.
+
+    python migrate_vectors.py
+"""
+import logging
+
+from rag import (
+    get_client, global_collection, collection_name, doc_collection, COLLECTION_METADATA
+)
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger("migrate_vectors")
+
+BATCH = 5000
+
+
+def legacy_doc_ids() -> list:
+    collection = global_collection()
+    ids, offset = set(), 0
+    while True:
+        res = collection.get(include=["metadatas"], limit=BATCH, offset=offset)
+        metas = res.get("metadatas") or []
+        ids.update(m["doc_id"] for m in metas if m and m.get("doc_id"))
+        if len(metas) < BATCH:
+            return sorted(ids)
+        offset += BATCH
+
+
+def migrate_doc(doc_id: str) -> int:
+    client, collection = get_client(), global_collection()
+    res = collection.get(
+        where={"doc_id": doc_id}, include=["embeddings", "documents", "metadatas"]
+    )
+    ids = res.get("ids") or []
+    if not ids:
+        return 0
+    name = collection_name(doc_id)
+    tmp_name = name[:58] + "__tmp"
+    try:
+        client.delete_collection(tmp_name)
+    except Exception:
+        pass
+    if doc_collection(doc_id) is not None:
+        # a previous run was interrupted after the rename: the copy is
+        # complete, only the global entries are left to delete
+        collection.delete(where={"doc_id": doc_id})
+        return len(ids)
+    # build the whole collection under a temporary name, then rename it:
+    # the API never sees a half-copied document collection
+    tmp = client.create_collection(tmp_name, metadata=COLLECTION_METADATA)
+    for i in range(0, len(ids), BATCH):
+        tmp.add(
+            ids=ids[i:i + BATCH],
+            embeddings=res["embeddings"][i:i + BATCH],
+            documents=res["documents"][i:i + BATCH],
+            metadatas=res["metadatas"][i:i + BATCH],
+        )
+    tmp.modify(name=name)
+    collection.delete(where={"doc_id": doc_id})
+    return len(ids)
+
+
+def migrate_global_collection() -> int:
+    migrated = 0
+    for doc_id in legacy_doc_ids():
+        n = migrate_doc(doc_id)
+        migrated += 1
+        logger.info(f"Moved {n} vectors of doc_id={doc_id}")
+    return migrated
+
+
+if __name__ == "__main__":
+    n = migrate_global_collection()
+    logger.info(f"Done: {n} documents moved to per-document collections.")
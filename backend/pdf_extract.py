@@ -0,0 +1,72 @@
+# pdf_extract.py
+# Kept free of app imports: page-range workers run in spawned processes
+# and only need PyMuPDF.
+import os
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from typing import Iterator, List
+
+import fitz  # PyMuPDF
+
+PDF_WORKERS = int(os.getenv("PDF_WORKERS", str(min(4, os.cpu_count() or 1))))
+PDF_PAGES_PER_TASK = int(os.getenv("PDF_PAGES_PER_TASK", "16"))
+# smaller documents are read serially; a process hop is not worth it
+PDF_PARALLEL_MIN_PAGES = int(os.getenv("PDF_PARALLEL_MIN_PAGES", "48"))
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                # spawn: never fork a process that holds Mongo/Chroma clients
+                _pool = ProcessPoolExecutor(
+                    max_workers=PDF_WORKERS, mp_context=get_context("spawn")
+                )
+    return _pool
+
+
+def page_count(path: str) -> int:
+    with fitz.open(path) as doc:
+        return len(doc)
+
+
+def extract_page_range(path: str, start: int, end: int) -> List[str]:
+    with fitz.open(path) as doc:
+        return [(doc[p].get_text("text") or "") for p in range(start, end)]
+
+
+def iter_pdf_pages(path: str, workers: int = PDF_WORKERS) -> Iterator[str]:
+    """
+    Yield page texts in order.
+    Large PDFs are split into page ranges extracted on a process pool;
+    at most 2 ranges per worker are in flight, so memory stays bounded.
+    """
+    n = page_count(path)
+
+    if workers <= 1 or n < PDF_PARALLEL_MIN_PAGES:
+        with fitz.open(path) as doc:
+            for p in range(n):
+                yield doc[p].get_text("text") or ""
+        return
+
+    pool = _get_pool()
+    ranges = deque(
+        (s, min(s + PDF_PAGES_PER_TASK, n)) for s in range(0, n, PDF_PAGES_PER_TASK)
+    )
+    pending = deque()
+    try:
+        while ranges or pending:
+            while ranges and len(pending) < workers * 2:
+                s, e = ranges.popleft()
+                pending.append(pool.submit(extract_page_range, path, s, e))
+            for text in pending.popleft().result():
+                yield text
+    finally:
+        for f in pending:
+            f.cancel()
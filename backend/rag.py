@@ -1,28 +1,157 @@
 # rag.py
+"""
+Chroma storage, sharded by document: each document's chunks live in
+their own collection (`doc_<doc_id>`), so a query searches a graph the
+size of that document, not of the whole corpus. Documents indexed
+before sharding stay in the global collection and are queried there
+with a doc_id filter until migrate_vectors.py moves them.
+
+Clients are created per process on first use (or at warm-up), never at
+import. A local persistent directory must not be shared by several
+worker processes: set CHROMA_HOST to use a Chroma server instead.
+"""
 import os
+import re
+import asyncio
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
+
 import chromadb
 
+import metrics
+
 CHROMA_DIR = os.getenv("CHROMA_PERSIST_DIR") or "./chroma_store"
+# Chroma is blocking (sqlite + hnswlib); it gets its own small pool so
+# slow index work never starves the event loop's default executor
+CHROMA_THREADS = int(os.getenv("CHROMA_THREADS", "4"))
+# "per_doc" (one collection per document) or "global" (the old single collection)
+CHROMA_LAYOUT = os.getenv("CHROMA_LAYOUT", "per_doc")
+# per-document collection handles kept open
+CHROMA_HANDLE_CACHE = int(os.getenv("CHROMA_HANDLE_CACHE", "1024"))
 
-client = chromadb.PersistentClient(path=CHROMA_DIR)
+# a Chroma server (required when several workers share one store)
+CHROMA_HOST = os.getenv("CHROMA_HOST")
+CHROMA_PORT = int(os.getenv("CHROMA_PORT", "8000"))
 
 COLLECTION_NAME = "project_tutor_chunks"
+COLLECTION_METADATA = {"hnsw:space": "cosine"}  # cosine similarity
 
-# Create or load collection
-try:
-    collection = client.get_collection(COLLECTION_NAME)
-except Exception:
-    collection = client.create_collection(
-        COLLECTION_NAME,
-        metadata={"hnsw:space": "cosine"}  # cosine similarity
-    )
+logger = logging.getLogger("backend.rag")
 
+_init_lock = threading.RLock()
+_client = None
+_client_pid = None
+_global_collection = None
+_pool = None
+_pool_pid = None
 
-def add_chunks_to_chroma(doc_id, chunk_ids, texts, embeddings, metadatas):
-    """
-    Add chunk embeddings to global Chroma collection.
-    metadata contains {doc_id, chunk_id, start, end}
-    """
+
+def get_client():
+    """This process's Chroma client, created on first use."""
+    global _client, _client_pid, _global_collection
+    with _init_lock:
+        if _client is None or _client_pid != os.getpid():
+            if CHROMA_HOST:
+                _client = chromadb.HttpClient(host=CHROMA_HOST, port=CHROMA_PORT)
+            else:
+                if int(os.getenv("WEB_CONCURRENCY", "1")) > 1:
+                    logger.warning(
+                        "Several workers on one local Chroma directory is unsafe; "
+                        "set CHROMA_HOST to a Chroma server."
+                    )
+                _client = chromadb.PersistentClient(path=CHROMA_DIR)
+            _client_pid = os.getpid()
+            _global_collection = None
+            _handles.clear()
+        return _client
+
+
+def global_collection():
+    """The global (legacy) collection, created if missing."""
+    global _global_collection
+    with _init_lock:
+        client = get_client()
+        if _global_collection is None:
+            try:
+                _global_collection = client.get_collection(COLLECTION_NAME)
+            except Exception:
+                _global_collection = client.create_collection(
+                    COLLECTION_NAME,
+                    metadata=COLLECTION_METADATA
+                )
+        return _global_collection
+
+
+_VALID_NAME = re.compile(r"^[a-zA-Z0-9][a-zA-Z0-9._-]{1,61}[a-zA-Z0-9]$")
+
+# doc_id → its collection; only collections known to exist are cached
+_handles: "OrderedDict[str, object]" = OrderedDict()
+_handles_lock = threading.Lock()
+
+
+def collection_name(doc_id: str) -> str:
+    name = f"doc_{doc_id}"
+    if _VALID_NAME.match(name) and ".." not in name:
+        return name
+    # Chroma names are 3-63 chars of [a-zA-Z0-9._-]
+    return "doc_" + hashlib.sha1(doc_id.encode("utf-8")).hexdigest()
+
+
+def doc_collection(doc_id: str, create: bool = False):
+    """The document's own collection, or None if it has none (and not `create`)."""
+    with _handles_lock:
+        col = _handles.get(doc_id)
+        if col is not None:
+            _handles.move_to_end(doc_id)
+            return col
+
+    name = collection_name(doc_id)
+    try:
+        if create:
+            col = get_client().get_or_create_collection(name, metadata=COLLECTION_METADATA)
+        else:
+            col = get_client().get_collection(name)
+    except Exception:
+        # not created yet, or indexed in the global collection
+        return None
+
+    with _handles_lock:
+        _handles[doc_id] = col
+        while len(_handles) > CHROMA_HANDLE_CACHE:
+            _handles.popitem(last=False)
+    return col
+
+
+def _route(doc_id):
+    """(collection, where filter) holding the document's chunks."""
+    if doc_id:
+        col = doc_collection(doc_id)
+        if col is not None:
+            return col, None
+        return global_collection(), {"doc_id": doc_id}
+    return global_collection(), None
+
+
+def _executor() -> ThreadPoolExecutor:
+    # threads do not survive fork(): each process starts its own pool
+    global _pool, _pool_pid
+    with _init_lock:
+        if _pool is None or _pool_pid != os.getpid():
+            _pool = ThreadPoolExecutor(max_workers=CHROMA_THREADS, thread_name_prefix="chroma")
+            _pool_pid = os.getpid()
+        return _pool
+
+
+async def _offload(fn, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor(), partial(fn, *args, **kwargs))
+
+
+def _add_chunks(doc_id, chunk_ids, texts, embeddings, metadatas):
     assert len(chunk_ids) == len(texts) == len(embeddings) == len(metadatas)
 
     # IDs must be globally unique → doc_id__chunk_id
@@ -33,7 +162,11 @@ def add_chunks_to_chroma(doc_id, chunk_ids, texts, embeddings, metadatas):
         m["doc_id"] = doc_id
         m["chunk_id"] = cid
 
-    collection.add(
+    if CHROMA_LAYOUT == "per_doc":
+        target = doc_collection(doc_id, create=True)
+    else:
+        target = global_collection()
+    target.add(
         ids=ids,
         embeddings=embeddings,
         documents=texts,
@@ -41,25 +174,25 @@ def add_chunks_to_chroma(doc_id, chunk_ids, texts, embeddings, metadatas):
     )
 
 
-def query_similar_chunks(query_emb, doc_id=None, n_results=4):
-    """
-    Returns top matching chunks.
-    If doc_id is provided, restrict retrieval to that document only.
-    """
+def _delete_document(doc_id):
+    with _handles_lock:
+        _handles.pop(doc_id, None)
+    try:
+        get_client().delete_collection(collection_name(doc_id))
+    except Exception:
+        pass  # never created (or indexed in the global collection)
+    if CHROMA_LAYOUT != "per_doc":
+        global_collection().delete(where={"doc_id": doc_id})
 
-    if doc_id:
-        # Use metadata filter to get only chunks of this PDF
-        res = collection.query(
-            query_embeddings=[query_emb],
-            n_results=n_results,
-            where={"doc_id": doc_id}
-        )
-    else:
-        # No filtering (not recommended)
-        res = collection.query(
-            query_embeddings=[query_emb],
-            n_results=n_results
-        )
+
+def _query(query_emb, doc_id=None, n_results=4):
+    col, where = _route(doc_id)
+    kwargs = {"where": where} if where else {}
+    res = col.query(
+        query_embeddings=[query_emb],
+        n_results=n_results,
+        **kwargs
+    )
 
     ids = res.get("ids", [[]])[0]
     docs = res.get("documents", [[]])[0]
@@ -74,3 +207,82 @@ def query_similar_chunks(query_emb, doc_id=None, n_results=4):
         })
 
     return results
+
+
+def _document_vectors(doc_id):
+    col, where = _route(doc_id)
+    kwargs = {"where": where} if where else {}
+    res = col.get(include=["embeddings", "metadatas"], **kwargs)
+    metas = res.get("metadatas")
+    embs = res.get("embeddings")  # may be a numpy array: no truth test
+    seqs, vectors = [], []
+    for meta, emb in zip(metas if metas is not None else [], embs if embs is not None else []):
+        seqs.append(int(meta["chunk_id"]))
+        vectors.append(emb)
+    return seqs, vectors
+
+
+def _document_entries(doc_id):
+    col, where = _route(doc_id)
+    kwargs = {"where": where} if where else {}
+    res = col.get(include=["embeddings", "documents", "metadatas"], **kwargs)
+    embs = res.get("embeddings")
+    return (
+        res.get("ids") or [],
+        res.get("documents") or [],
+        res.get("metadatas") or [],
+        embs if embs is not None else [],
+    )
+
+
+async def add_chunks_to_chroma(doc_id, chunk_ids, texts, embeddings, metadatas):
+    """
+    Add chunk embeddings to the document's Chroma collection.
+    metadata contains {doc_id, chunk_id, start, end}
+    """
+    with metrics.stage("chroma_add"):
+        await _offload(_add_chunks, doc_id, chunk_ids, texts, embeddings, metadatas)
+
+
+async def delete_document(doc_id):
+    """Remove every vector of a document (its collection, or its global entries)."""
+    with metrics.stage("chroma_delete"):
+        await _offload(_delete_document, doc_id)
+
+
+async def query_similar_chunks(query_emb, doc_id=None, n_results=4):
+    """
+    Returns top matching chunks.
+    If doc_id is provided, restrict retrieval to that document only.
+    """
+    with metrics.stage("chroma_query"):
+        return await _offload(_query, query_emb, doc_id, n_results)
+
+
+async def get_document_vectors(doc_id):
+    """(chunk seqs, vectors) of every indexed chunk of a document."""
+    with metrics.stage("chroma_get"):
+        return await _offload(_document_vectors, doc_id)
+
+
+async def get_document_entries(doc_id):
+    """(ids, texts, metadatas, vectors) of every indexed chunk of a document."""
+    with metrics.stage("chroma_get"):
+        return await _offload(_document_entries, doc_id)
+
+
+async def warm_up():
+    """Open the client and the global collection before the first request."""
+    await _offload(global_collection)
+
+
+async def heartbeat():
+    return await _offload(lambda: get_client().heartbeat())
+
+
+def shutdown():
+    global _pool
+    with _init_lock:
+        if _pool is not None and _pool_pid == os.getpid():
+            _pool.shutdown(wait=False)
+        _pool = None
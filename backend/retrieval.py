@@ -0,0 +1,169 @@
+# retrieval.py
+"""
+Chunk retrieval for prompts: vector (Chroma), lexical (BM25), or both
+fused with reciprocal rank fusion. Falls back to lexical when a document
+has no vectors or the query embedding fails.
+"""
+import os
+import asyncio
+import logging
+from typing import List
+
+import lexical
+import metrics
+import vector_cache
+from database import chunks_collection
+from gemini_client import embed_query
+from rag import query_similar_chunks
+
+# default mode for generation endpoints and non-keyword chat questions
+RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "hybrid")
+MODES = ("vector", "lexical", "hybrid")
+RRF_K = int(os.getenv("RRF_K", "60"))
+# chat questions this short (and not phrased as a question) skip embedding
+CHAT_KEYWORD_MAX_WORDS = int(os.getenv("CHAT_KEYWORD_MAX_WORDS", "4"))
+
+QUESTION_WORDS = frozenset(
+    "what why how when where which who whom whose explain describe compare "
+    "define does do is are can could should would will".split()
+)
+
+logger = logging.getLogger("backend.retrieval")
+
+CHUNK_FIELDS = {
+    "_id": 0,
+    "seq": 1,
+    "chunk_id": 1,
+    "text": 1,
+    "start": 1,
+    "end": 1,
+    "page_start": 1,
+    "page_end": 1,
+}
+
+
+def _hit(doc_id: str, rec: dict) -> dict:
+    """A chunk record in the same shape as a Chroma hit."""
+    return {
+        "id": f"{doc_id}__{rec['chunk_id']}",
+        "document": rec["text"],
+        "metadata": {
+            "doc_id": doc_id,
+            "chunk_id": rec["chunk_id"],
+            "start": rec.get("start"),
+            "end": rec.get("end"),
+            "page_start": rec.get("page_start"),
+            "page_end": rec.get("page_end"),
+        },
+    }
+
+
+async def fetch_chunks(doc_id: str, seqs: List[int]) -> List[dict]:
+    """Hits for the given chunk seqs, in that order."""
+    if not seqs:
+        return []
+    by_seq = {}
+    with metrics.stage("mongo_read"):
+        async for rec in chunks_collection.find(
+            {"doc_id": doc_id, "seq": {"$in": seqs}}, CHUNK_FIELDS
+        ):
+            by_seq[rec["seq"]] = rec
+    return [_hit(doc_id, by_seq[s]) for s in seqs if s in by_seq]
+
+
+async def lexical_hits(doc_id: str, query: str, n: int) -> List[dict]:
+    with metrics.stage("lexical_search"):
+        ranked = await lexical.search(doc_id, query, n)
+    return await fetch_chunks(doc_id, [seq for seq, _ in ranked])
+
+
+async def vector_hits(doc_id: str, query: str, n: int) -> List[dict]:
+    q_emb = await embed_query(query)
+    if vector_cache.enabled():
+        return await vector_cache.search(doc_id, q_emb, n)
+    return await query_similar_chunks(q_emb, doc_id, n_results=n)
+
+
+async def spread_hits(doc_id: str, n: int, exclude=()) -> List[dict]:
+    """n chunks spread evenly over the document (coverage when search finds little)."""
+    count = await chunks_collection.count_documents({"doc_id": doc_id})
+    if not count or n <= 0:
+        return []
+    step = count / n
+    seqs = sorted({int(i * step + step / 2) for i in range(n)} - set(exclude))
+    return await fetch_chunks(doc_id, seqs)
+
+
+def _chunk_key(hit: dict):
+    meta = hit.get("metadata") or {}
+    return meta.get("chunk_id", hit["id"])
+
+
+def fuse(ranked_lists: List[List[dict]], n: int) -> List[dict]:
+    """Reciprocal rank fusion; best first."""
+    scores, hits = {}, {}
+    for ranked in ranked_lists:
+        for rank, h in enumerate(ranked):
+            key = _chunk_key(h)
+            scores[key] = scores.get(key, 0.0) + 1.0 / (RRF_K + rank + 1)
+            hits.setdefault(key, h)
+    best = sorted(scores, key=lambda k: -scores[k])[:n]
+    return [hits[k] for k in best]
+
+
+def is_keyword_query(question: str) -> bool:
+    """Short lookups like "gradient descent formula" (not "how does ... ?")."""
+    words = question.strip().split()
+    return (
+        0 < len(words) <= CHAT_KEYWORD_MAX_WORDS
+        and "?" not in question
+        and words[0].lower() not in QUESTION_WORDS
+        and bool(lexical.tokenize(question))
+    )
+
+
+async def retrieve(
+    doc_id: str,
+    query: str,
+    n_results: int,
+    mode: str = None,
+    has_vectors: bool = True,
+    fill: bool = False,
+) -> List[dict]:
+    """
+    Top chunks of `doc_id` for `query`, best first.
+    `fill` tops the result up with chunks spread over the document, so
+    generation still has context when search finds too little.
+    """
+    mode = mode or RETRIEVAL_MODE
+    if mode != "lexical" and not has_vectors:
+        mode = "lexical"
+
+    if mode == "lexical":
+        hits = await lexical_hits(doc_id, query, n_results)
+    elif mode == "vector":
+        try:
+            hits = await vector_hits(doc_id, query, n_results)
+        except Exception as ex:
+            logger.warning(f"Vector retrieval failed, using lexical: {ex!r}")
+            hits = await lexical_hits(doc_id, query, n_results)
+    else:
+        vec, lex = await asyncio.gather(
+            vector_hits(doc_id, query, n_results),
+            lexical_hits(doc_id, query, n_results),
+            return_exceptions=True,
+        )
+        if isinstance(vec, BaseException):
+            logger.warning(f"Vector retrieval failed, using lexical only: {vec!r}")
+            vec = []
+        if isinstance(lex, BaseException):
+            if not vec:
+                raise lex
+            logger.warning(f"Lexical retrieval failed, using vectors only: {lex!r}")
+            lex = []
+        hits = fuse([vec, lex], n_results)
+
+    if fill and len(hits) < n_results:
+        have = {int(_chunk_key(h)) for h in hits if str(_chunk_key(h)).isdigit()}
+        hits = hits + await spread_hits(doc_id, n_results - len(hits), exclude=have)
+    return hits
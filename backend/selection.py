@@ -0,0 +1,64 @@
+# selection.py
+"""
+Representative chunks of a document, chosen from its own chunk vectors:
+maximal marginal relevance against the document centroid. The first
+pick is the most central chunk; each next pick trades closeness to the
+centroid against similarity to what is already picked, so the set
+covers the document's topics instead of repeating one.
+
+Picks come out in order, and any prefix is itself an MMR selection, so
+one stored list serves every top_k.
+"""
+import os
+import asyncio
+from typing import List, Sequence
+
+import numpy as np
+
+from rag import get_document_vectors
+
+# chunks kept per document (summary/notes take a prefix)
+REPRESENTATIVE_CHUNKS = int(os.getenv("REPRESENTATIVE_CHUNKS", "24"))
+# 1.0 = pure centrality, 0.0 = pure diversity
+SELECTION_LAMBDA = float(os.getenv("SELECTION_LAMBDA", "0.5"))
+
+
+def mmr_select(vectors, k: int, lambda_: float = SELECTION_LAMBDA) -> List[int]:
+    """Row indices of `vectors` (n x d) in MMR pick order, at most k."""
+    X = np.asarray(vectors, dtype=np.float32)
+    if X.ndim != 2 or not len(X):
+        return []
+    X = X / np.maximum(np.linalg.norm(X, axis=1, keepdims=True), 1e-12)
+
+    centroid = X.mean(axis=0)
+    centroid /= max(float(np.linalg.norm(centroid)), 1e-12)
+    relevance = X @ centroid
+
+    n = len(X)
+    k = min(k, n)
+    redundancy = np.zeros(n, dtype=np.float32)
+    chosen = np.zeros(n, dtype=bool)
+    picks = []
+    for _ in range(k):
+        score = lambda_ * relevance - (1 - lambda_) * redundancy
+        score[chosen] = -np.inf
+        i = int(np.argmax(score))
+        picks.append(i)
+        chosen[i] = True
+        np.maximum(redundancy, X @ X[i], out=redundancy)
+    return picks
+
+
+def select_representatives(
+    seqs: Sequence[int], vectors, k: int = REPRESENTATIVE_CHUNKS
+) -> List[int]:
+    """Chunk seqs (aligned with `vectors`) of the representative set, in pick order."""
+    return [int(seqs[i]) for i in mmr_select(vectors, k)]
+
+
+async def representatives_from_index(doc_id: str, k: int = REPRESENTATIVE_CHUNKS) -> List[int]:
+    """Same selection for documents ingested before it existed: read the vectors back from Chroma."""
+    seqs, vectors = await get_document_vectors(doc_id)
+    if not seqs:
+        return []
+    return await asyncio.to_thread(select_representatives, seqs, vectors, k)
@@ -0,0 +1,139 @@
+# singleflight.py
+import os
+import time
+import uuid
+import socket
+import asyncio
+import logging
+from datetime import datetime, timedelta
+
+from pymongo.errors import DuplicateKeyError
+
+from database import leases_collection
+
+# a lease outlives a crashed holder by at most this long; a live holder
+# renews it every LEASE_TTL / 3 seconds, however long its work runs
+LEASE_TTL = int(os.getenv("SINGLEFLIGHT_LEASE_TTL", "180"))
+LEASE_POLL = float(os.getenv("SINGLEFLIGHT_POLL", "0.5"))
+
+logger = logging.getLogger("backend.singleflight")
+
+_owner_id = None
+_owner_pid = None
+_inflight = {}
+
+
+def _owner() -> str:
+    """This process's lease owner id (never shared with a forked worker)."""
+    global _owner_id, _owner_pid
+    if _owner_id is None or _owner_pid != os.getpid():
+        _owner_pid = os.getpid()
+        _owner_id = f"{socket.gethostname()}:{_owner_pid}:{uuid.uuid4().hex[:8]}"
+    return _owner_id
+
+
+async def _acquire_lease(key: str) -> bool:
+    now = datetime.utcnow()
+    try:
+        # matches only a free (expired) or own lease; otherwise the upsert
+        # collides on _id and someone else holds it
+        await leases_collection.update_one(
+            {"_id": key, "$or": [{"expires_at": {"$lt": now}}, {"owner": _owner()}]},
+            {
+                "$set": {
+                    "owner": _owner(),
+                    "expires_at": now + timedelta(seconds=LEASE_TTL),
+                }
+            },
+            upsert=True,
+        )
+        return True
+    except DuplicateKeyError:
+        return False
+
+
+async def _release_lease(key: str):
+    try:
+        await leases_collection.delete_one({"_id": key, "owner": _owner()})
+    except Exception as ex:
+        logger.warning(f"Failed to release lease {key}: {ex}")
+
+
+async def _renew_lease(key: str):
+    """Keep extending the lease while its holder works (cancelled when done)."""
+    while True:
+        await asyncio.sleep(LEASE_TTL / 3)
+        try:
+            await leases_collection.update_one(
+                {"_id": key, "owner": _owner()},
+                {"$set": {"expires_at": datetime.utcnow() + timedelta(seconds=LEASE_TTL)}},
+            )
+        except Exception as ex:
+            logger.warning(f"Failed to renew lease {key}: {ex}")
+
+
+async def _wait_for_release(key: str):
+    deadline = time.monotonic() + LEASE_TTL
+    while time.monotonic() < deadline:
+        lease = await leases_collection.find_one({"_id": key}, {"expires_at": 1})
+        if not lease or lease["expires_at"] < datetime.utcnow():
+            return
+        await asyncio.sleep(LEASE_POLL)
+
+
+async def _run_leader(key: str, fn, after_wait):
+    waited = False
+    while not await _acquire_lease(key):
+        waited = True
+        await _wait_for_release(key)
+
+    renew = asyncio.create_task(_renew_lease(key))
+    try:
+        # another worker just did the work; after_wait normally only reads it
+        if waited and after_wait is not None:
+            return await after_wait()
+        return await fn()
+    finally:
+        renew.cancel()
+        await _release_lease(key)
+
+
+async def local(key: str, fn):
+    """
+    Run `await fn()` once per key at a time, in this process only:
+    concurrent callers wait for and share the first caller's result (or
+    exception). Keys share one namespace with do(): prefix them.
+    """
+    fut = _inflight.get(key)
+    if fut is not None:
+        # shield: a cancelled follower must not cancel the leader's result
+        return await asyncio.shield(fut)
+
+    fut = asyncio.get_running_loop().create_future()
+    _inflight[key] = fut
+    try:
+        result = await fn()
+    except asyncio.CancelledError:
+        fut.cancel()
+        raise
+    except BaseException as ex:
+        fut.set_exception(ex)
+        # followers re-raise it; don't warn about an unretrieved exception
+        fut.exception()
+        raise
+    else:
+        fut.set_result(result)
+        return result
+    finally:
+        _inflight.pop(key, None)
+
+
+async def do(key: str, fn, after_wait=None):
+    """
+    Run `await fn()` once per key at a time.
+    Concurrent callers in this process share the first caller's result
+    (see local()). Across processes a Mongo lease makes other workers
+    wait; once the holder finishes they run after_wait() (or fn() if not
+    given) instead, which should pick up the stored result.
+    """
+    return await local(key, lambda: _run_leader(key, fn, after_wait))
@@ -0,0 +1,6 @@
+import os
+import sys
+
+# backend modules import each other by plain name (`import metrics`)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("EMBED_CACHE_PATH", "")
@@ -0,0 +1,44 @@
+import random
+
+import pytest
+
+from chunker import iter_chunks
+
+WORDS = (
+    "the network learns weights by gradient descent and backpropagation "
+    "each layer applies a linear map followed by a nonlinearity"
+).split()
+
+
+def prose(n_lines: int, seed: int = 1) -> str:
+    rnd = random.Random(seed)
+    return "\n".join(
+        " ".join(rnd.choice(WORDS) for _ in range(rnd.randint(6, 16))).capitalize()
+        + rnd.choice([".", ".", "?", ":"])
+        for _ in range(n_lines)
+    )
+
+
+@pytest.mark.parametrize(
+    "kwargs",
+    [
+        {"max_tokens": 100},
+        {"max_tokens": 50},
+        {"chunk_size": 400, "overlap": 200},
+        {"chunk_size": 200, "overlap": 150, "boundary": "word"},
+    ],
+)
+def test_chunk_starts_advance(kwargs):
+    pages = [prose(120, seed=s) for s in range(3)]
+    chunks = list(iter_chunks(pages, **kwargs))
+    assert len(chunks) > 10
+    starts = [c["start"] for c in chunks]
+    ends = [c["end"] for c in chunks]
+    assert all(b - a > 10 for a, b in zip(starts, starts[1:]))
+    assert len(set(ends)) == len(ends)
+
+
+def test_default_overlap_kept():
+    chunks = list(iter_chunks([prose(200)], chunk_size=1000, overlap=200))
+    # consecutive chunks still share text
+    assert all(b["start"] < a["end"] for a, b in zip(chunks, chunks[1:]))
@@ -0,0 +1,60 @@
+import time
+import asyncio
+
+import pytest
+
+from gemini_client import Channel, CircuitBreaker, CircuitOpen, TokenBucket, _call
+
+
+def opened_channel(cooldown: float, elapsed: float) -> Channel:
+    """A channel whose breaker opened `elapsed` seconds ago (1 request per minute, none left)."""
+    channel = Channel("test", rpm=1, tpm=0, concurrency=4)
+    channel.breaker = CircuitBreaker(threshold=1, cooldown=cooldown)
+    channel.breaker.record_failure()
+    channel.breaker.opened_at -= elapsed
+    channel.requests.level = 0
+    return channel
+
+
+def test_trial_cancelled_while_rate_limited_does_not_wedge_breaker():
+    async def main():
+        channel = opened_channel(cooldown=0.05, elapsed=0.05)
+
+        async def ok():
+            return "ok"
+
+        # the trial caller times out while waiting for a request token
+        with pytest.raises(asyncio.TimeoutError):
+            await asyncio.wait_for(_call(channel, ok, 1, 1), 0.05)
+        assert not channel.breaker._trial
+
+        channel.requests = TokenBucket(0)
+        assert await _call(channel, ok, 1, 1) == "ok"
+        assert channel.breaker.state == "closed"
+
+    asyncio.run(main())
+
+
+def test_lost_trial_reopens_after_cooldown():
+    breaker = CircuitBreaker(threshold=1, cooldown=0.05)
+    breaker.record_failure()
+    breaker.opened_at -= breaker.cooldown
+    breaker.before_call()  # the trial, which never reports back
+    with pytest.raises(CircuitOpen):
+        breaker.before_call()
+
+    time.sleep(0.06)
+    breaker.before_call()  # the stale trial expired: this call is the new trial
+    assert breaker.state == "half_open"
+    breaker.record_success()
+    assert breaker.state == "closed"
+
+
+def test_open_breaker_rejects_before_waiting_for_budget():
+    async def main():
+        channel = opened_channel(cooldown=60, elapsed=0)
+        with pytest.raises(CircuitOpen):
+            await asyncio.wait_for(channel.admit(1), 1)
+        assert channel.rejected == 1
+
+    asyncio.run(main())
@@ -0,0 +1,122 @@
+# vector_cache.py
+"""
+Exact vector search over one document, in memory.
+
+A document has tens to a few hundred chunks: one matrix-vector product
+over its normalised vectors is faster than a Chroma HNSW query, and
+exact. Each document's vectors are read from Chroma once (Chroma stays
+the durable store) into a contiguous matrix, with texts and metadata
+held by row, and kept in an LRU bounded by memory.
+"""
+import os
+import asyncio
+from collections import OrderedDict
+from typing import List
+
+import numpy as np
+
+import metrics
+import singleflight
+from rag import get_document_entries
+
+# memory for cached documents (matrices + texts); 0 disables the cache
+VECTOR_CACHE_MB = float(os.getenv("VECTOR_CACHE_MB", "256"))
+# float16 halves the memory; scores stay accurate to ~1e-3
+VECTOR_CACHE_DTYPE = np.dtype(os.getenv("VECTOR_CACHE_DTYPE", "float32"))
+# searching a matrix this large takes milliseconds: do it off the event loop
+THREAD_MIN_ROWS = 20000
+
+
+class DocVectors:
+    """One document's chunks: row i of `matrix` is the unit vector of ids[i]."""
+
+    def __init__(self, ids, texts, metadatas, vectors):
+        self.ids = list(ids)
+        self.texts = list(texts)
+        self.metadatas = list(metadatas)
+        m = np.asarray(vectors, dtype=np.float32)
+        if not self.ids:
+            m = np.zeros((0, 0), dtype=np.float32)
+        m /= np.maximum(np.linalg.norm(m, axis=1, keepdims=True), 1e-12)
+        self.matrix = np.ascontiguousarray(m, dtype=VECTOR_CACHE_DTYPE)
+        self.nbytes = self.matrix.nbytes + sum(len(t or "") for t in self.texts)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _hits(self, scores, k: int) -> List[dict]:
+        k = min(k, len(scores))
+        if k <= 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [
+            {"id": self.ids[i], "document": self.texts[i], "metadata": self.metadatas[i]}
+            for i in top
+        ]
+
+    def search(self, query, k: int) -> List[dict]:
+        """Top-k chunks by cosine similarity, best first."""
+        if not self.ids:
+            return []
+        q = np.asarray(query, dtype=np.float32)
+        q /= max(float(np.linalg.norm(q)), 1e-12)
+        scores = self.matrix @ q.astype(self.matrix.dtype)
+        return self._hits(scores.astype(np.float32), k)
+
+
+_cache: "OrderedDict[str, DocVectors]" = OrderedDict()
+_cached_bytes = 0
+
+
+def _store(doc_id: str, vectors: DocVectors):
+    global _cached_bytes
+    budget = VECTOR_CACHE_MB * 1024 * 1024
+    if vectors.nbytes > budget:
+        return
+    _cache[doc_id] = vectors
+    _cached_bytes += vectors.nbytes
+    while _cached_bytes > budget:
+        _, old = _cache.popitem(last=False)
+        _cached_bytes -= old.nbytes
+
+
+async def _load(doc_id: str) -> DocVectors:
+    ids, texts, metadatas, vectors = await get_document_entries(doc_id)
+    vectors = await asyncio.to_thread(DocVectors, ids, texts, metadatas, vectors)
+    # a document without vectors is not cached: it may still be indexing
+    if len(vectors):
+        _store(doc_id, vectors)
+    return vectors
+
+
+async def get_vectors(doc_id: str) -> DocVectors:
+    """The document's vectors, loaded once and kept in the LRU."""
+    vectors = _cache.get(doc_id)
+    if vectors is not None:
+        _cache.move_to_end(doc_id)
+        metrics.VECTOR_CACHE_LOOKUPS.inc(result="hit")
+        return vectors
+    metrics.VECTOR_CACHE_LOOKUPS.inc(result="miss")
+    return await singleflight.local(f"vectors:{doc_id}", lambda: _load(doc_id))
+
+
+def enabled() -> bool:
+    return VECTOR_CACHE_MB > 0
+
+
+async def search(doc_id: str, query, k: int) -> List[dict]:
+    vectors = await get_vectors(doc_id)
+    with metrics.stage("vector_search"):
+        if len(vectors) >= THREAD_MIN_ROWS:
+            return await asyncio.to_thread(vectors.search, query, k)
+        return vectors.search(query, k)
+
+
+def stats() -> dict:
+    return {
+        "documents": len(_cache),
+        "mb": round(_cached_bytes / (1024 * 1024), 2),
+        "max_mb": VECTOR_CACHE_MB,
+        "dtype": VECTOR_CACHE_DTYPE.name,
+    }
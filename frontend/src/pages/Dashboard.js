@@ -40,17 +40,17 @@ export default function Dashboard() {
   // -------------------------------
   // SUMMARY (separate)
   // -------------------------------
-  const loadSummary = async () => {
+  // The POST returns the stored summary when one exists;
+  // force=true asks the backend to regenerate it.
+  const loadSummary = async (force = false) => {
     try {
       setSummaryLoading(true);
 
-      await fetch(`${API}/summary`, {
+      const r = await fetch(`${API}/summary`, {
         method: "POST",
         headers: { "Content-Type": "application/json" },
-        body: JSON.stringify({ doc_id: id }),
+        body: JSON.stringify({ doc_id: id, force }),
       });
-
-      const r = await fetch(`${API}/docs/${id}/summary`);
       const d = await r.json();
       setSummary(d.summary || "");
     } catch (e) {
@@ -64,19 +64,17 @@ export default function Dashboard() {
   // -------------------------------
   // NOTES (separate, heading-wise)
   // -------------------------------
-  const loadNotes = async () => {
+  const loadNotes = async (force = false) => {
     try {
       setNotesLoading(true);
 
-      await fetch(`${API}/notes`, {
+      const r = await fetch(`${API}/notes`, {
         method: "POST",
         headers: { "Content-Type": "application/json" },
-        body: JSON.stringify({ doc_id: id }),
+        body: JSON.stringify({ doc_id: id, force }),
       });
-
-      const r = await fetch(`${API}/docs/${id}/notes`);
       const d = await r.json();
-      setNotes(d.notes || null);
+      setNotes(d.sections ? d : null);
     } catch (e) {
       console.error(e);
       alert("Failed to load notes.");
@@ -88,7 +86,7 @@ export default function Dashboard() {
   // -------------------------------
   // MCQ GENERATION
   // -------------------------------
-  const generateMcq = async () => {
+  const generateMcq = async (force = false) => {
     try {
       setMcqLoading(true);
       setMcq(null);
@@ -103,6 +101,7 @@ export default function Dashboard() {
           doc_id: id,
           difficulty: mcqLevel,
           num: mcqNum,
+          force,
         }),
       });
 
@@ -120,7 +119,7 @@ export default function Dashboard() {
   // -------------------------------
   // FILLUPS GENERATION
   // -------------------------------
-  const generateFillups = async () => {
+  const generateFillups = async (force = false) => {
     try {
       setFillupsLoading(true);
       setFillups(null);
@@ -135,6 +134,7 @@ export default function Dashboard() {
           doc_id: id,
           difficulty: fillLevel,
           num: fillNum,
+          force,
         }),
       });
 
@@ -159,15 +159,46 @@ export default function Dashboard() {
     setChatMessages((prev) => [...prev, { role: "user", text: userMsg }]);
     setChatInput("");
 
+    // Append streamed text to the last (ai) message
+    const appendAi = (delta) =>
+      setChatMessages((prev) => {
+        const last = prev[prev.length - 1];
+        return [...prev.slice(0, -1), { ...last, text: last.text + delta }];
+      });
+
     try {
-      const r = await fetch(`${API}/chat`, {
+      const r = await fetch(`${API}/chat/stream`, {
         method: "POST",
         headers: { "Content-Type": "application/json" },
         body: JSON.stringify({ question: userMsg, doc_id: id }),
       });
-
-      const d = await r.json();
-      setChatMessages((prev) => [...prev, { role: "ai", text: d.answer }]);
+      if (!r.ok || !r.body) throw new Error(`chat failed: ${r.status}`);
+
+      setChatMessages((prev) => [...prev, { role: "ai", text: "" }]);
+
+      // Server-Sent Events: blocks separated by a blank line
+      const reader = r.body.getReader();
+      const decoder = new TextDecoder();
+      let buf = "";
+      while (true) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        buf += decoder.decode(value, { stream: true });
+
+        let sep;
+        while ((sep = buf.indexOf("\n\n")) !== -1) {
+          const block = buf.slice(0, sep);
+          buf = buf.slice(sep + 2);
+
+          const event = (block.match(/^event: (.*)$/m) || [])[1];
+          const data = (block.match(/^data: (.*)$/m) || [])[1];
+          if (!data) continue;
+          const d = JSON.parse(data);
+
+          if (event === "error") appendAi(d.error || "Failed to generate answer.");
+          else if (d.delta) appendAi(d.delta);
+        }
+      }
     } catch (e) {
       console.error(e);
       alert("Failed to send chat.");
@@ -338,7 +369,10 @@ export default function Dashboard() {
       {/* SUMMARY */}
       <div style={{ padding: 20, border: "1px solid black", marginBottom: 20 }}>
         <h3>Summary</h3>
-        <button onClick={loadSummary}>Generate Summary</button>
+        <button onClick={() => loadSummary()}>Generate Summary</button>
+        <button onClick={() => loadSummary(true)} style={{ marginLeft: 8 }}>
+          Regenerate
+        </button>
         {summaryLoading && (
           <p style={{ marginTop: 8 }}><b>Generating summary...</b></p>
         )}
@@ -350,7 +384,10 @@ export default function Dashboard() {
       {/* NOTES */}
       <div style={{ padding: 20, border: "1px solid black", marginBottom: 20 }}>
         <h3>Notes (Heading-wise)</h3>
-        <button onClick={loadNotes}>Generate Notes</button>
+        <button onClick={() => loadNotes()}>Generate Notes</button>
+        <button onClick={() => loadNotes(true)} style={{ marginLeft: 8 }}>
+          Regenerate
+        </button>
         {notesLoading && (
           <p style={{ marginTop: 8 }}><b>Generating notes...</b></p>
         )}
@@ -414,7 +451,10 @@ export default function Dashboard() {
           />
         </div>
 
-        <button onClick={generateMcq}>Generate MCQs</button>
+        <button onClick={() => generateMcq()}>Generate MCQs</button>
+        <button onClick={() => generateMcq(true)} style={{ marginLeft: 8 }}>
+          Regenerate
+        </button>
         {mcqLoading && (
           <p style={{ marginTop: 8 }}><b>Generating MCQs...</b></p>
         )}
@@ -505,7 +545,10 @@ export default function Dashboard() {
           />
         </div>
 
-        <button onClick={generateFillups}>Generate Fillups</button>
+        <button onClick={() => generateFillups()}>Generate Fillups</button>
+        <button onClick={() => generateFillups(true)} style={{ marginLeft: 8 }}>
+          Regenerate
+        </button>
         {fillupsLoading && (
           <p style={{ marginTop: 8 }}><b>Generating fillups...</b></p>
         )}
@@ -1,11 +1,35 @@
 import React, { useState } from "react";
 import { useNavigate } from "react-router-dom";
 
+// "extracting (pages 40/120, chunks 300, embedded 200)"
+const describeJob = (job) => {
+  const parts = [];
+  if (job.pages_count) parts.push(`pages ${job.pages_read || 0}/${job.pages_count}`);
+  if (job.chunks_count) parts.push(`chunks ${job.chunks_count}`);
+  if (job.chunks_embedded) parts.push(`embedded ${job.chunks_embedded}`);
+  const stage = job.stage || "";
+  return parts.length ? `${stage} (${parts.join(", ")})` : stage;
+};
+
 export default function Upload() {
   const [file, setFile] = useState(null);
   const [loading, setLoading] = useState(false);
+  const [stage, setStage] = useState("");
   const nav = useNavigate();
 
+  const API = "http://127.0.0.1:8000";
+
+  // Poll the ingestion job until it is done (or failed)
+  const waitForJob = async (jobId) => {
+    while (true) {
+      await new Promise((res) => setTimeout(res, 1000));
+      const r = await fetch(`${API}/jobs/${jobId}`);
+      const job = await r.json();
+      setStage(describeJob(job));
+      if (job.status === "done" || job.status === "failed") return job;
+    }
+  };
+
   const uploadPDF = async () => {
     if (!file) return;
 
@@ -13,17 +37,37 @@ export default function Upload() {
     fd.append("file", file);
 
     setLoading(true);
+    setStage("uploading");
+
+    try {
+      const r = await fetch(`${API}/upload`, {
+        method: "POST",
+        body: fd,
+      });
 
-    const r = await fetch("http://127.0.0.1:8000/upload", {
-      method: "POST",
-      body: fd,
-    });
+      const d = await r.json();
+      if (!r.ok) {
+        alert(d.detail || "Upload failed.");
+        return;
+      }
 
-    const d = await r.json();
-    setLoading(false);
+      if (d.status === "ok") {
+        nav(`/dashboard/${d.doc_id}`);
+        return;
+      }
 
-    if (d.status === "ok") {
-      nav(`/dashboard/${d.doc_id}`);
+      const job = await waitForJob(d.job_id);
+      if (job.status === "done") {
+        nav(`/dashboard/${d.doc_id}`);
+      } else {
+        alert(job.error || "Processing failed.");
+      }
+    } catch (e) {
+      console.error(e);
+      alert("Upload failed.");
+    } finally {
+      setLoading(false);
+      setStage("");
     }
   };
 
@@ -33,7 +77,7 @@ export default function Upload() {
       <input type="file" onChange={(e) => setFile(e.target.files[0])} />
       <br />
       <button onClick={uploadPDF} disabled={!file || loading}>
-        {loading ? "Processing..." : "Upload"}
+        {loading ? `Processing... ${stage}` : "Upload"}
       </button>
     </div>
   );